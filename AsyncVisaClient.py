@@ -0,0 +1,37 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+
+class AsyncVisaClient:
+    """
+    asyncio front end for a connected VisaClient.
+
+    pyvisa is blocking, so every call is handed to a single worker thread owned by the instrument. Commands sent to one
+    instrument therefore stay strictly ordered, while awaiting several instruments at once (asyncio.gather) lets their
+    bus and measurement waits overlap:
+
+        vmeas, imeas = await asyncio.gather(self.read_voltage_async('INPUT2', samples),
+                                            self.read_f8588A_async(samples=samples))
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"visa-{client.instr_info['mode']}")
+
+    async def call(self, fn, *args, **kwargs):
+        """Runs a blocking callable (typically a driver method) on this instrument's worker thread"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(fn, *args, **kwargs))
+
+    async def write(self, cmd):
+        return await self.call(self.client.write, cmd)
+
+    async def read(self):
+        return await self.call(self.client.read)
+
+    async def query(self, cmd):
+        return await self.call(self.client.query, cmd)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
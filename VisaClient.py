@@ -1,17 +1,186 @@
 import pyvisa as visa
+import numpy as np
+import atexit
 import re
+import threading
 import time
+import VisaSimulator
+import visa_trace
+from latency_stats import LATENCY
+from contextlib import contextmanager
+
+
+TERMINATION = re.compile(r'[\r\n|\r\n|\n]+')
+FIELD = re.compile(r'\s*,\s*')
+RESET = re.compile(r'\*RST\b', re.IGNORECASE)
+NO_VALUE = 9.9E+37  # the 8588A returns 9.91E+37 when there is no valid value to return
+
+
+def parse_float(field):
+    """Converts a response field to float. Unparsable fields and the 9.91E+37 "no value" sentinel become NaN."""
+    try:
+        value = float(field)
+    except ValueError:
+        return np.nan
+    return np.nan if abs(value) >= NO_VALUE else value
+
+
+def join_commands(commands, max_length=256, root=True):
+    """
+    Joins a queue of commands into as few ';' separated program messages as fit within max_length.
+
+    In SCPI, a command following a ';' is parsed relative to the header path of the command before it. Prefixing each
+    non-common command with ':' returns the parser to the root of the command tree so that queued commands behave the
+    same as when they were written one at a time. Instruments without a command tree (5560A, 5790B) use root=False.
+
+    :param commands: list of commands in the order they are to be executed
+    :param max_length: the largest program message (in characters) the instrument accepts
+    :param root: prefix non-common commands with ':'
+    :return: list of program messages
+    """
+    messages = []
+    message = ''
+    for cmd in commands:
+        cmd = f'{cmd}'.strip()
+        if root and not cmd.startswith((':', '*')):
+            cmd = f':{cmd}'
+        if message and len(message) + len(cmd) + 1 > max_length:
+            messages.append(message)
+            message = cmd
+        else:
+            message = f'{message};{cmd}' if message else cmd
+    if message:
+        messages.append(message)
+    return messages
+
+
+def read_ieee_block(instr, dtype='>f8', expect_termination=True):
+    """
+    Reads an IEEE 488.2 definite length block (#<digits><length><data>) from an open resource and decodes the data
+    bytes directly into a NumPy array, without building an intermediate string or list.
+
+    :param instr: pyvisa message based resource
+    :param dtype: NumPy dtype of the block data. '>f8' is FORMat:DATA REAL,64 with FORMat:BORDer NORMal
+    :param expect_termination: consume the termination character that follows the block
+    :return: NumPy array of the decoded values
+    """
+    header = instr.read_bytes(2)
+    if header[:1] != b'#' or not header[1:2].isdigit() or header[1:2] == b'0':
+        raise ValueError(f'Response is not an IEEE 488.2 definite length block. Header: {header}')
+    length = int(instr.read_bytes(int(header[1:2])))
+    data = instr.read_bytes(length)
+    if expect_termination:
+        instr.read_bytes(1)
+    return np.frombuffer(data, dtype=dtype)
+
+
+# SESSION POOL #########################################################################################################
+_resource_managers = {}
+_sessions = {}
+_session_locks = {}
+_sessions_lock = threading.Lock()
+
+
+def resource_name(instr_info):
+    """Returns the VISA resource string of an instrument id, or None when its mode is not supported"""
+    mode = instr_info['mode']
+    # TODO - verify this works as intended... Otherwise leave INSTR lines commented
+    # if mode is SOCKET:
+    if mode == 'SOCKET':
+        return f"TCPIP0::{instr_info['address']}::{instr_info['port']}::SOCKET"
+    # if mode is GPIB:
+    elif mode == 'GPIB':
+        return f"GPIB0::{instr_info['gpib']}::0::INSTR"
+    # if mode is INSTR:
+    elif mode == 'INSTR':
+        return f"TCPIP0::{instr_info['address']}::inst0::INSTR"
+    # TODO - http://lampx.tugraz.at/~hadley/num/ch9/python/9.2.php
+    # if mode is SERIAL or USB:
+    elif mode in ('SERIAL', 'USB'):
+        return f"{instr_info['address']}"
+    # if mode is SIM:
+    elif mode == 'SIM':
+        return f"SIM::{instr_info['model']}"
+    # if mode is REPLAY:
+    elif mode == 'REPLAY':
+        return instr_info['resource']
+    return None
+
+
+def get_resource_manager(instr_info):
+    """Returns the resource manager shared by every session of the process, creating it on first use"""
+    mode = instr_info['mode']
+    if mode == 'SIM':
+        backend = ('SIM',)
+    elif mode == 'REPLAY':
+        backend = ('REPLAY', instr_info['trace'], instr_info.get('speed', 1.0))
+    else:
+        backend = ('VISA',)
+
+    with _sessions_lock:
+        if backend not in _resource_managers:
+            if mode == 'SIM':
+                _resource_managers[backend] = VisaSimulator.SimulatedResourceManager()
+            elif mode == 'REPLAY':
+                _resource_managers[backend] = visa_trace.ReplayResourceManager(*backend[1:])
+            else:
+                _resource_managers[backend] = visa.ResourceManager()
+        return _resource_managers[backend]
+
+
+def get_session(instr_id):
+    """
+    Returns an open VisaClient for the instrument, keyed by its resource string. A session opened by an earlier run is
+    handed out again after a quick health check, and reconnected only if that check fails. The instrument may have been
+    reconfigured since (from its front panel or by another program), so the shadow state of a reused session is
+    cleared. Sessions stay open until close_sessions() is called (registered to run at exit).
+    """
+    key = resource_name(instr_id)
+    with _sessions_lock:
+        lock = _session_locks.setdefault(key, threading.Lock())
+
+    # sessions to different instruments may be opened concurrently
+    with lock:
+        client = _sessions.get(key)
+        if client is None:
+            client = VisaClient(instr_id)
+            if client.healthy:
+                _sessions[key] = client
+        else:
+            client.invalidate()
+            if not client.is_alive():
+                print(f'[STALE] reconnecting to {key}')
+                client.close()
+                client.connect()
+                if not client.healthy:
+                    _sessions.pop(key)
+        return client
+
+
+def close_sessions():
+    with _sessions_lock:
+        clients = list(_sessions.values())
+        _sessions.clear()
+    for client in clients:
+        client.close()
+
+
+atexit.register(close_sessions)
 
 
 class VisaClient:
     def __init__(self, id):
         self.healthy = True
+        self.batching = False
+        self.batch_queue = []
+        self.shadow = {}  # last known instrument configuration written through set_state
 
         try:
-            self.rm = visa.ResourceManager()
             self.instr_info = id
             self.mode = self.instr_info['mode']
+            self.rm = get_resource_manager(self.instr_info)
             self.timeout = 60000  # 1 (60e3) minute timeout
+            self.max_message_length = self.instr_info.get('max_message_length', 256)
         except ValueError:
             from textwrap import dedent
             msg = ("\n[ValueError] - Could not locate a VISA implementation. Install either the NI binary or pyvisa-py."
@@ -25,57 +194,79 @@ class VisaClient:
         if self.healthy:
             self.connect()
 
-    def connect(self):
-        for attempt in range(5):
+    def connect(self, attempts=5):
+        """
+        Opens the session, retrying with exponential backoff. An optional 'deadline' (s) in the instrument id bounds
+        the time spent on all attempts together, and 'backoff' (s) sets the delay after the first failed attempt.
+        """
+        self.shadow = {}
+        resource = resource_name(self.instr_info)
+        deadline = self.instr_info.get('deadline')
+        backoff = self.instr_info.get('backoff', 0.5)
+        start = time.time()
+        self.idn = ''
+        self.connect_error = ''
+
+        for attempt in range(attempts):
             self.healthy = True
+            # real VISA sessions may block for a long time while opening. Bound that by the remaining deadline
+            remaining = deadline - (time.time() - start) if deadline else None
+            options = {'open_timeout': int(max(remaining, 0.1) * 1000)} if remaining is not None else {}
             try:
-                # TODO - verify this works as intended... Otherwise leave INSTR lines commented
-                # if mode is SOCKET:
-                if self.mode == 'SOCKET':
-                    # SOCKET is a non-protocol raw TCP connection
-                    address = self.instr_info['address']
-                    port = self.instr_info['port']
-                    self.INSTR = self.rm.open_resource(f'TCPIP0::{address}::{port}::SOCKET', read_termination='\n')
-
-                # if mode is GPIB:
-                elif self.mode == 'GPIB':
-                    address = self.instr_info['gpib']
-                    self.INSTR = self.rm.open_resource(f'GPIB0::{address}::0::INSTR')
-
-                # if mode is INSTR:
-                elif self.mode == 'INSTR':
-                    # INSTR is a VXI-11 protocol
-                    address = self.instr_info['address']
-                    self.INSTR = self.rm.open_resource(f'TCPIP0::{address}::inst0::INSTR', read_termination='\n')
-
-                # if mode is SERIAL:
+                if resource is None:
+                    print('No such mode.')
+
+                # SOCKET is a non-protocol raw TCP connection, INSTR is a VXI-11 protocol
+                elif self.mode in ('SOCKET', 'INSTR', 'USB'):
+                    self.INSTR = self.rm.open_resource(resource, read_termination='\n', **options)
+
                 elif self.mode == 'SERIAL':
-                    address = self.instr_info['address']
-                    self.INSTR = self.rm.open_resource(f'{address}')
+                    self.INSTR = self.rm.open_resource(resource, **options)
                     self.INSTR.read_termination = '\n'
 
-                # TODO - http://lampx.tugraz.at/~hadley/num/ch9/python/9.2.php
-                # if mode is SERIAL:
-                elif self.mode == 'USB':
-                    address = self.instr_info['address']
-                    self.INSTR = self.rm.open_resource(f'{address}', read_termination='\n')
+                # offline simulated instrument. See VisaSimulator.py
+                elif self.mode == 'SIM':
+                    options = {key: self.instr_info[key] for key in ('latency', 'noise', 'settling', 'reading_time')
+                               if key in self.instr_info}
+                    self.INSTR = self.rm.open_resource(resource, **options)
+
+                elif self.mode == 'REPLAY':
+                    self.INSTR = self.rm.open_resource(resource)
 
                 else:
-                    print('No such mode.')
+                    self.INSTR = self.rm.open_resource(resource, **options)
+
+                # record the session to a trace file. See visa_trace.py
+                if self.instr_info.get('record'):
+                    recorder = visa_trace.get_recorder(self.instr_info['record'])
+                    self.INSTR = visa_trace.RecordingResource(self.INSTR, recorder, resource)
 
                 # test communication to instrument by identifying instrument
-                idn = re.sub(r'[\r\n|\r\n|\n]+', '', self.INSTR.query('*IDN?').lstrip(' '))
+                if remaining is not None:
+                    self.INSTR.timeout = int(max(remaining, 0.1) * 1000)
+                idn = TERMINATION.sub('', self.INSTR.query('*IDN?').lstrip(' '))
+                self.idn = idn
                 print(f"[FOUND] {idn}")
 
-            except visa.VisaIOError:
+            except visa.VisaIOError as e:
                 # https://github.com/pyvisa/pyvisa-py/issues/146#issuecomment-453695057
-                print(f'[attempt {attempt + 1}/5] - retrying connection to instrument')
+                print(f'[attempt {attempt + 1}/{attempts}] - retrying connection to {resource}')
                 self.healthy = False
+                self.connect_error = f'{e}'
+
+                remaining = deadline - (time.time() - start) if deadline else None
+                if attempt == attempts - 1 or (remaining is not None and remaining <= 0):
+                    break
+                delay = backoff * 2 ** attempt
+                time.sleep(min(delay, remaining) if remaining is not None else delay)
+            except visa_trace.ReplayDivergence:
+                raise
             except Exception:
                 raise ValueError('Could not connect. Session timed out.')
             else:
                 break
 
+        self.connect_time = time.time() - start
         if not self.healthy:
             self.InstrumentConnectionFailed(self.instr_info)
         else:
@@ -91,44 +282,255 @@ class VisaClient:
     def info(self):
         return self.instr_info
 
+    def is_alive(self, timeout=2000):
+        """Health check of an open session. Identifies the instrument with a short timeout."""
+        try:
+            self.INSTR.timeout = timeout
+            try:
+                self.INSTR.query('*IDN?')
+            finally:
+                # the pooled session keeps its normal timeout whether or not the instrument answered
+                self.INSTR.timeout = self.timeout
+        except Exception:
+            # covers VisaIOError, a closed session (InvalidSession) and a session that was never opened
+            return False
+        return True
+
     def IDN(self):
         try:
             if self.mode == 'NIGHTHAWK':
-                response = re.sub(r'[\r\n|\r\n|\n]+', '', self.INSTR.query('*IDN?').split("\r")[0].lstrip(' '))
+                response = TERMINATION.sub('', self.INSTR.query('*IDN?').split("\r")[0].lstrip(' '))
             else:
-                response = re.sub(r'[\r\n|\r\n|\n]+', '', self.INSTR.query('*IDN?').lstrip(' '))
+                response = TERMINATION.sub('', self.INSTR.query('*IDN?').lstrip(' '))
                 return response
         except visa.VisaIOError:
             self.healthy = False
             print('*IDN? was not returned. Failed to connect to address.')
             raise
 
+    def clock(self):
+        """
+        time.perf_counter() for decisions that depend on time: polling deadlines and reading timestamps. Recorded
+        sessions log every value and replayed sessions return the logged ones (see visa_trace), so a replay takes the
+        same decisions as the recorded run.
+        """
+        clock = getattr(self.INSTR, 'clock', None)
+        return clock() if callable(clock) else time.perf_counter()
+
+    @contextmanager
+    def timed(self, op, cmd=''):
+        """Records the round trip time of the block in latency_stats.LATENCY when recording is enabled"""
+        if not LATENCY.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            LATENCY.record(resource_name(self.instr_info), op, cmd, time.perf_counter() - start)
+
     def write(self, cmd):
+        if RESET.search(f'{cmd}'):
+            self.invalidate()
+        if self.batching:
+            self.batch_queue.append(f'{cmd}')
+            return
         try:
-            self.INSTR.write(f'{cmd}')
-            self.IDN()
+            with self.timed('write', cmd):
+                self.INSTR.write(f'{cmd}')
+                self.IDN()
         except visa.VisaIOError as e:
             print('Could not write to device.')
+            self.invalidate()
             raise ValueError(e)
 
+    def set_state(self, key, value, cmd=None):
+        """
+        Writes a configuration command only when it changes the instrument's last known state. The shadow copy is
+        cleared by *RST, by failed transactions and by invalidate, after which the command is sent again.
+
+            self.f5790B.set_state('INPUT', 'INPUT2')  # sends 'INPUT INPUT2' the first time only
+
+        :param key: configuration item (usually the command header)
+        :param value: new setting
+        :param cmd: command to send, if not '<key> <value>'
+        :return: True if the command was sent
+        """
+        if key in self.shadow and self.shadow[key] == value:
+            return False
+        self.write(cmd or f'{key} {value}')
+        self.shadow[key] = value
+        return True
+
+    def invalidate(self, prefix=''):
+        """Forgets the last known state of every configuration item whose key starts with prefix (all by default)"""
+        for key in [key for key in self.shadow if key.startswith(prefix)]:
+            del self.shadow[key]
+
+    @contextmanager
+    def batch(self, check='OPC', root=True):
+        """
+        Queues every write issued within the block and sends the queue as few program messages as possible when the
+        block exits. Completion is checked once for the whole queue instead of once per write.
+
+            with self.f8588A.batch():
+                self.f8588A.write('TRIGger:RESet')
+                self.f8588A.write(f'TRIGGER:COUNT {N}')
+
+        :param check: 'OPC' queries *OPC?, 'ERR' reads the error queue, 'IDN' queries *IDN?
+        :param root: see join_commands
+        """
+        if self.batching:
+            # nested batches are folded into the outermost batch
+            yield self
+            return
+
+        self.batching = True
+        try:
+            yield self
+        except Exception:
+            self.batch_queue = []
+            self.invalidate()
+            raise
+        finally:
+            self.batching = False
+        self.flush(check, root)
+
+    def flush(self, check='OPC', root=True):
+        queue, self.batch_queue = self.batch_queue, []
+        if not queue:
+            return
+        try:
+            for message in join_commands(queue, self.max_message_length, root):
+                with self.timed('batch', message):
+                    self.INSTR.write(message)
+            with self.timed('check', check):
+                self.check_complete(check)
+        except visa.VisaIOError as e:
+            print('Could not write to device.')
+            self.invalidate()
+            raise ValueError(e)
+        except ValueError:
+            self.invalidate()
+            raise
+
+    def wait_complete(self, timeout=30, cmd=''):
+        """
+        Blocks until the instrument reports that all pending operations are complete. The instrument holds the *OPC?
+        response until then, so the query is issued with the session timeout raised to the longest acceptable wait.
+
+        :param timeout: longest wait in seconds
+        :param cmd: optional overlapped command (e.g. 'INIT:IMM') sent in the same program message as *OPC?
+        :return: True once complete, False if the timeout expired first
+        """
+        self.INSTR.timeout = timeout * 1000
+        try:
+            with self.timed('opc', cmd):
+                self.INSTR.query(f'{cmd};*OPC?' if cmd else '*OPC?')
+            return True
+        except visa.VisaIOError:
+            print(f'[TIMEOUT] operation did not complete within {timeout} s')
+            # device clear discards the *OPC? response that would otherwise arrive with the next read
+            self.INSTR.clear()
+            self.invalidate()
+            return False
+        finally:
+            self.INSTR.timeout = self.timeout
+
+    def status_byte(self):
+        if self.mode == 'GPIB':
+            return self.INSTR.read_stb()  # serial poll
+        return int(self.query('*STB?'))
+
+    def wait_for_status(self, mask, timeout=30, interval=0.05):
+        """
+        Polls the status byte until any of the bits in mask are set (e.g. 0x20 ESB, 0x10 MAV)
+
+        :return: True if a bit in mask was set before the timeout expired
+        """
+        deadline = self.clock() + timeout
+        while self.clock() < deadline:
+            if self.status_byte() & mask:
+                return True
+            time.sleep(interval)
+        return False
+
+    def wait_for_srq(self, timeout=30):
+        """
+        Waits for a service request (GPIB only). Enable the request beforehand, for example with
+        '*ESE 1;*SRE 32;*OPC' so that operation complete asserts SRQ.
+
+        :return: True if the service request was asserted before the timeout expired
+        """
+        try:
+            self.INSTR.wait_for_srq(timeout * 1000)
+            return True
+        except visa.VisaIOError:
+            return False
+
+    def check_complete(self, check='OPC'):
+        if check == 'OPC':
+            self.INSTR.query('*OPC?')
+        elif check == 'ERR':
+            error = TERMINATION.sub('', self.INSTR.query('SYST:ERR?').lstrip(' '))
+            if not error.startswith(('0', '+0')):
+                raise ValueError(f'Instrument reported an error: {error}')
+        else:
+            self.IDN()
+
     def read(self):
         response = None
+        with self.timed('read'):
+            raw = self.INSTR.read()
         if self.mode == 'NIGHTHAWK':
-            response = re.sub(r'[\r\n|\r\n|\n]+', '', self.INSTR.read().split("\n")[0].lstrip())
+            response = TERMINATION.sub('', raw.split("\n")[0].lstrip())
         else:
-            response = re.sub(r'[\r\n|\r\n|\n]+', '', self.INSTR.read())
+            response = TERMINATION.sub('', raw)
         return response
 
     def query(self, cmd):
+        if RESET.search(f'{cmd}'):
+            self.invalidate()
         try:
+            with self.timed('query', cmd):
+                raw = self.INSTR.query(f'{cmd}')
             if self.mode == 'NIGHTHAWK':
-                response = re.sub(r'[\r\n|\r\n|\n]+', '', self.INSTR.query(f'{cmd}').split("\n")[0].lstrip(' '))
+                response = TERMINATION.sub('', raw.split("\n")[0].lstrip(' '))
             else:
-                response = re.sub(r'[\r\n|\r\n|\n]+', '', self.INSTR.query(f'{cmd}').lstrip(' '))
+                response = TERMINATION.sub('', raw.lstrip(' '))
             return response
+        except visa.VisaIOError as e:
+            self.invalidate()
+            raise ValueError(e)
+
+    def query_binary(self, cmd, dtype='>f8'):
+        """Queries a command that returns an IEEE 488.2 definite length block. See read_ieee_block"""
+        try:
+            with self.timed('query', cmd):
+                self.INSTR.write(f'{cmd}')
+                return read_ieee_block(self.INSTR, dtype)
         except visa.VisaIOError as e:
             raise ValueError(e)
 
+    def query_fields(self, cmd):
+        """:return: the comma separated fields of the response"""
+        return FIELD.split(self.query(cmd))
+
+    def query_float(self, cmd, field=0):
+        """:return: one field of the response as float, NaN when there is no valid value"""
+        fields = self.query_fields(cmd)
+        return parse_float(fields[field]) if field < len(fields) else np.nan
+
+    def query_floats(self, cmd):
+        """:return: NumPy array of every field of the response, NaN where there is no valid value"""
+        fields = self.query_fields(cmd)
+        try:
+            values = np.array(fields, dtype=float)
+        except ValueError:
+            values = np.array([parse_float(field) for field in fields])
+        values[np.abs(values) >= NO_VALUE] = np.nan
+        return values
+
     def close(self):
         try:
             self.INSTR.close()
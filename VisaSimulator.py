@@ -0,0 +1,438 @@
+"""
+Offline instrument backend for VisaClient
+
+The classes below stand in for the pyvisa resource manager and message based resources so that the drivers
+(dut_f5560A, dmm_f8588A, dmm_f5790B) and dual_output_test.Test can run without hardware. The three simulated
+instruments share a SimulatedBench, so the DMMs measure whatever the simulated 5560A is sourcing, including the
+exponential settling that follows an output change.
+
+    f5560A_id = {'mode': 'SIM', 'model': '5560A', 'latency': 0.005, 'noise': 2e-6, 'settling': 0.5}
+
+The same instruments can be served over raw TCP for SOCKET mode:
+
+    server = serve('8588A', port=3490)
+"""
+import pyvisa as visa
+import math
+import random
+import re
+import socketserver
+import threading
+import time
+import numpy as np
+
+
+sim_instruments = {'f5560A': {'mode': 'SIM', 'model': '5560A', 'gpib': '4'},
+                   'f8588A': {'mode': 'SIM', 'model': '8588A', 'gpib': '24'},
+                   'f5790B': {'mode': 'SIM', 'model': '5790B', 'gpib': '6'}}
+
+NAN = 9.91E+37  # returned by the 8588A when there is no valid value to return
+
+
+def scpi(mnemonic):
+    """
+    Converts a SCPI mnemonic written in long form (e.g. 'TRIGger:COUNt') into a regular expression matching both the
+    short form (TRIG:COUN) and the long form (TRIGGER:COUNT) of the header, regardless of case.
+    """
+    nodes = []
+    for node in mnemonic.rstrip('?').split(':'):
+        short = re.match(r'[^a-z]*', node).group(0)
+        extra = node[len(short):].upper()
+        if not short:
+            # lower case mnemonics (e.g. 5560A commands) have no short form
+            nodes.append(re.escape(node))
+        else:
+            nodes.append(re.escape(short) + (f'(?:{re.escape(extra)})?' if extra else ''))
+    pattern = ':'.join(nodes) + (r'\?' if mnemonic.endswith('?') else '')
+    return re.compile(f':?{pattern}$', re.IGNORECASE)
+
+
+def split_message(message):
+    """Splits a program message on ';' while leaving quoted strings intact"""
+    return [cmd.strip() for cmd in re.findall(r'(?:"[^"]*"|[^;"])+', message) if cmd.strip()]
+
+
+def to_value(s, default=0.0):
+    match = re.match(r'\s*([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)\s*(m|u|k)?', s)
+    if not match:
+        return default
+    scale = {'m': 1e-3, 'u': 1e-6, 'k': 1e3}.get(match.group(2), 1.0)
+    return float(match.group(1)) * scale
+
+
+########################################################################################################################
+class SimulatedBench:
+    """The shared state of the 5560A output that the simulated DMMs measure"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.voltage = 0.0
+        self.current = 0.0
+        self.frequency = 0.0
+        self.phase = 0.0
+        self.operate = False
+        self.lows = 'OPEN'
+        self.tau = 0.1
+
+        # output seen by the DMMs immediately before the last change, and the time of that change
+        self._previous = (0.0, 0.0)
+        self._changed = 0.0
+
+    def _settled(self, now):
+        voltage, current = (self.voltage, self.current) if self.operate else (0.0, 0.0)
+        decay = math.exp(-(now - self._changed) / self.tau) if self.tau > 0 else 0.0
+        return (voltage + (self._previous[0] - voltage) * decay,
+                current + (self._previous[1] - current) * decay)
+
+    def change(self, settling, **kwargs):
+        with self.lock:
+            now = time.time()
+            self._previous = self._settled(now)
+            self._changed = now
+            self.tau = settling / 12  # within 6 ppm of the final value after 'settling' seconds
+            for key, value in kwargs.items():
+                setattr(self, key, value)
+
+    def output(self, quantity):
+        with self.lock:
+            voltage, current = self._settled(time.time())
+        return voltage if quantity == 'VOLT' else current
+
+    def remaining_settling(self):
+        with self.lock:
+            return max(self._changed + 12 * self.tau - time.time(), 0.0)
+
+
+BENCH = SimulatedBench()
+
+
+########################################################################################################################
+class SimulatedInstrument:
+    """
+    A minimal pyvisa message based resource. Every program message is split into its commands, which are dispatched
+    to the handler whose header pattern matches. Responses of the query commands in one message are joined with ';'
+    and returned by the next read, as an IEEE 488.2 instrument would.
+    """
+    model = ''
+    idn = ''
+
+    def __init__(self, bench=None, latency=0.0, noise=0.0, settling=0.0, reading_time=0.02):
+        self.bench = bench or BENCH
+        self.latency = latency
+        self.noise = noise
+        self.settling = settling
+        self.reading_time = reading_time  # duration of one triggered reading
+
+        self.timeout = 60000
+        self.read_termination = '\n'
+        self.responses = []
+        self.raw = b''
+        self.errors = []
+        self.handlers = [(scpi('*IDN?'), lambda args: self.idn),
+                         (scpi('*RST'), lambda args: self.reset()),
+                         (scpi('*CLS'), lambda args: self.errors.clear()),
+                         (scpi('*OPC?'), lambda args: self.opc()),
+                         (scpi('*WAI'), lambda args: self.wait()),
+                         (scpi('SYSTem:ERRor?'), lambda args: self.errors.pop(0) if self.errors else '+0,"No error"')]
+        self.handlers += [(scpi(mnemonic), handler) for mnemonic, handler in self.commands()]
+        self.reset()
+
+    def commands(self):
+        return []
+
+    def reset(self):
+        pass
+
+    def wait(self):
+        pass
+
+    def opc(self):
+        self.wait()
+        return '1'
+
+    def measure(self, quantity):
+        value = self.bench.output(quantity)
+        return value + random.gauss(0.0, self.noise * abs(value) + 1e-9)
+
+    # pyvisa resource interface ----------------------------------------------------------------------------------------
+    def write(self, message):
+        time.sleep(self.latency)
+        responses = []
+        for cmd in split_message(message):
+            header, _, args = cmd.partition(' ')
+            for pattern, handler in self.handlers:
+                if pattern.match(header):
+                    response = handler(args.strip())
+                    if isinstance(response, bytes):
+                        # binary blocks are returned as their own response message
+                        self.responses.append(response)
+                    elif '?' in header and response is not None:
+                        responses.append(f'{response}')
+                    break
+            else:
+                self.errors.append(f'-113,"Undefined header; {header}"')
+        if responses:
+            self.responses.append(';'.join(responses))
+        return len(message)
+
+    def read(self):
+        time.sleep(self.latency)
+        if not self.responses:
+            raise visa.VisaIOError(visa.constants.StatusCode.error_timeout)
+        return self.responses.pop(0)
+
+    def read_bytes(self, count):
+        while len(self.raw) < count:
+            if not self.responses:
+                raise visa.VisaIOError(visa.constants.StatusCode.error_timeout)
+            response = self.responses.pop(0)
+            response = response if isinstance(response, bytes) else response.encode()
+            self.raw += response + self.read_termination.encode()
+        data, self.raw = self.raw[:count], self.raw[count:]
+        return data
+
+    def query(self, message):
+        self.write(message)
+        return self.read()
+
+    def clear(self):
+        self.responses = []
+        self.raw = b''
+
+    def close(self):
+        self.clear()
+
+
+########################################################################################################################
+class Simulated5560A(SimulatedInstrument):
+    model = '5560A'
+    idn = 'FLUKE,5560A,SIM0001,1.0'
+
+    def commands(self):
+        return [('out?', self.output_query),
+                ('out', self.output),
+                ('phase', lambda args: self.bench.change(self.settling, phase=to_value(args))),
+                ('oper', lambda args: self.bench.change(self.settling, operate=True)),
+                ('stby', lambda args: self.bench.change(self.settling, operate=False)),
+                ('LOWS?', lambda args: self.bench.lows),
+                ('LOWS', lambda args: setattr(self.bench, 'lows', args.upper())),
+                ('read', lambda args: '#hDC'),
+                ('write', lambda args: None),
+                ('mod', lambda args: None),
+                ('wizard', lambda args: None),
+                ('ponwiz', lambda args: None),
+                ('COMM_MODE', lambda args: None),
+                ('^C', lambda args: None),
+                ('MONITOR?', lambda args: 'OFF'),
+                ('MONITOR', lambda args: None),
+                ('EXTGUARD', lambda args: None)]
+
+    def reset(self):
+        self.bench.change(self.settling, voltage=0.0, current=0.0, frequency=0.0, phase=0.0, operate=False)
+
+    def output(self, args):
+        voltage, current, frequency = 0.0, 0.0, 0.0
+        for arg in args.split(','):
+            unit = arg.strip()[-2:].upper()
+            if unit == 'HZ':
+                frequency = to_value(arg)
+            elif unit.endswith('A'):
+                current = to_value(arg)
+            elif unit.endswith('V'):
+                voltage = to_value(arg)
+        self.bench.change(self.settling, voltage=voltage, current=current, frequency=frequency)
+
+    def output_query(self, args):
+        bench = self.bench
+        if bench.voltage == 0 and bench.current != 0:
+            return f'{bench.current:E},A,{0:E},0,{bench.frequency:E}'
+        return f'{bench.voltage:E},V,{bench.current:E},A,{bench.frequency:E}'
+
+    def wait(self):
+        time.sleep(self.bench.remaining_settling())
+
+
+########################################################################################################################
+class Simulated8588A(SimulatedInstrument):
+    model = '8588A'
+    idn = 'FLUKE,8588A,SIM0002,1.0'
+    ranges = {'CURR': [10e-6, 100e-6, 1e-3, 10e-3, 100e-3, 1, 10, 30], 'VOLT': [0.1, 1, 10, 100, 1000]}
+
+    def commands(self):
+        return [('CONFigure:VOLTage:AC', lambda args: self.configure('VOLT', 'AC')),
+                ('CONFigure:VOLTage:DC', lambda args: self.configure('VOLT', 'DC')),
+                ('CONFigure:CURRent:AC', lambda args: self.configure('CURR', 'AC')),
+                ('CONFigure:CURRent:DC', lambda args: self.configure('CURR', 'DC')),
+                ('VOLTage:AC:RANGe?', lambda args: self.range()),
+                ('VOLTage:DC:RANGe?', lambda args: self.range()),
+                ('CURRent:AC:RANGe?', lambda args: self.range()),
+                ('CURRent:DC:RANGe?', lambda args: self.range()),
+                ('VOLTage:AC:RANGe:AUTO', lambda args: None),
+                ('VOLTage:DC:RANGe:AUTO', lambda args: None),
+                ('CURRent:AC:RANGe:AUTO', lambda args: None),
+                ('CURRent:DC:RANGe:AUTO', lambda args: None),
+                ('FUNCtion', self.function),
+                ('DIGitize:VOLTage:RANGe', lambda args: None),
+                ('DIGitize:CURRent:RANGe', lambda args: None),
+                ('DIGitize:FILTer', lambda args: None),
+                ('DIGitize:APERture', lambda args: setattr(self, 'aperture', to_value(args))),
+                ('TRIGger:RESet', lambda args: setattr(self, 'trigger_count', 1)),
+                ('TRIGger:COUNt', lambda args: setattr(self, 'trigger_count', max(int(to_value(args, 1)), 1))),
+                ('TRIGger:DELay:AUTO', lambda args: None),
+                ('TRIGger:DELay', lambda args: None),
+                ('INITiate:IMMediate', lambda args: self.initiate()),
+                ('FORMat:DATA', lambda args: setattr(self, 'format', args.split(',')[0].strip().upper()[:4])),
+                ('FORMat:BORDer', lambda args: setattr(self, 'byte_order', args.strip().upper()[:4])),
+                ('FETCh?', self.fetch),
+                ('TRACe:DATA?', self.trace)]
+
+    def reset(self):
+        self.mode, self.func = 'VOLT', 'DC'
+        self.digitize = False
+        self.aperture = 0.0
+        self.trigger_count = 1
+        self.format = 'ASC'
+        self.byte_order = 'NORM'
+        self.buffer = np.array([])
+        self.frequency = NAN
+        self.busy_until = 0.0
+
+    def configure(self, mode, function):
+        self.mode, self.func, self.digitize = mode, function, False
+
+    def function(self, args):
+        args = args.strip('" ').upper()
+        self.digitize = args.startswith('DIG')
+        self.mode = 'CURR' if 'CURR' in args else 'VOLT'
+
+    def range(self):
+        value = abs(self.bench.output(self.mode))
+        return f'{next((r for r in self.ranges[self.mode] if value <= r), self.ranges[self.mode][-1]):E}'
+
+    def initiate(self):
+        now = time.time()
+        if self.digitize:
+            Fs = 5e6 / (round(self.aperture / 200e-9) + 1)
+            t = np.arange(self.trigger_count) / Fs
+            amplitude = self.bench.output(self.mode) * math.sqrt(2)
+            frequency = self.bench.frequency
+            if frequency > 0:
+                signal = amplitude * np.sin(2 * np.pi * frequency * t + np.radians(self.bench.phase))
+            else:
+                signal = np.full(self.trigger_count, amplitude / math.sqrt(2))
+            self.buffer = signal + np.random.normal(0.0, self.noise * abs(amplitude) + 1e-9, self.trigger_count)
+            self.busy_until = now + self.trigger_count / Fs
+        else:
+            self.buffer = np.array([self.measure(self.mode) for _ in range(self.trigger_count)])
+            self.busy_until = now + self.trigger_count * self.reading_time
+        self.frequency = self.bench.frequency if self.func == 'AC' and self.bench.operate else NAN
+
+    def wait(self):
+        time.sleep(max(self.busy_until - time.time(), 0.0))
+
+    def fetch(self, args):
+        self.wait()
+        if not self.buffer.size:
+            return f'{NAN:E}'
+        if args == '1':
+            return f'{self.buffer[-1]:E}'
+        if args == '2':
+            return f'{self.frequency:E}'
+        return self.block(self.buffer)
+
+    def trace(self, args):
+        self.wait()
+        start, count = (int(to_value(arg)) for arg in args.split(','))
+        return self.block(self.buffer[start - 1:start - 1 + count])
+
+    def block(self, values):
+        if self.format != 'REAL':
+            return ','.join(f'{value:E}' for value in values)
+        data = values.astype('>f8' if self.byte_order == 'NORM' else '<f8').tobytes()
+        return f'#{len(str(len(data)))}{len(data)}'.encode() + data
+
+
+########################################################################################################################
+class Simulated5790B(SimulatedInstrument):
+    model = '5790B'
+    idn = 'FLUKE,5790B,SIM0003,1.0'
+
+    def commands(self):
+        return [('INPUT', lambda args: setattr(self, 'input', args.upper())),
+                ('EXTRIG', lambda args: setattr(self, 'extrig', args.upper() in ('ON', '1'))),
+                ('HIRES', lambda args: None),
+                ('EXTGUARD', lambda args: None),
+                ('DFILT', lambda args: None),
+                ('TRIG', lambda args: self.trigger()),
+                ('VAL?', lambda args: f"{self.value():.8E},V,{self.bench.frequency:E}")]
+
+    def reset(self):
+        self.input = 'INPUT1'
+        self.extrig = False
+        self.reading = (0.0, 0.0)
+        self.busy_until = 0.0
+
+    def trigger(self):
+        # a triggered reading completes after reading_time
+        self.busy_until = time.time() + self.reading_time
+        self.reading = (self.busy_until, self.measure('VOLT'))
+
+    def wait(self):
+        time.sleep(max(self.busy_until - time.time(), 0.0))
+
+    def value(self):
+        # VAL? returns the most recent reading. Untriggered, the 5790B updates it once every reading_time
+        now = time.time()
+        if not self.extrig and now - self.reading[0] >= self.reading_time:
+            self.reading = (now, self.measure('VOLT'))
+        return self.reading[1]
+
+
+models = {'5560A': Simulated5560A, '8588A': Simulated8588A, '5790B': Simulated5790B}
+
+
+########################################################################################################################
+class SimulatedResourceManager:
+    """Stands in for pyvisa.ResourceManager. Resources are named SIM::<model>"""
+
+    def __init__(self, bench=None):
+        self.bench = bench or BENCH
+
+    def list_resources(self):
+        return tuple(f'SIM::{model}' for model in models)
+
+    def open_resource(self, resource_name, **kwargs):
+        model = resource_name.split('::')[-1]
+        if model not in models:
+            raise visa.VisaIOError(visa.constants.StatusCode.error_resource_not_found)
+        return models[model](self.bench, **kwargs)
+
+    def close(self):
+        pass
+
+
+def serve(model, port, host='127.0.0.1', bench=None, **kwargs):
+    """
+    Serves a simulated instrument as a raw TCP SCPI socket (VisaClient SOCKET mode). Each line received is handled as a
+    program message and responses are returned with a '\\n' termination.
+
+    :return: the running server. Call server.shutdown() to stop serving.
+    """
+    instrument = models[model](bench, **kwargs)
+    lock = threading.Lock()
+
+    class SCPIHandler(socketserver.StreamRequestHandler):
+        def handle(self):
+            for line in self.rfile:
+                with lock:
+                    instrument.write(line.decode().strip())
+                    responses, instrument.responses = instrument.responses, []
+                for response in responses:
+                    # binary blocks (IEEE 488.2) are sent as they are, only text responses are encoded
+                    response = response if isinstance(response, bytes) else response.encode()
+                    self.wfile.write(response + b'\n')
+
+    server = socketserver.ThreadingTCPServer((host, port), SCPIHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,53 @@
+"""
+Adaptive sample counts for the DMM drivers
+
+A fixed sample count oversamples quiet readings and undersamples noisy ones. acquire() starts with the requested
+number of readings and keeps adding readings until the standard error of the mean reaches target_ppm of the mean, or
+until MAX_SAMPLES readings or MAX_TIME seconds are reached:
+
+    stats, readings = acquire(take, samples=5, target_ppm=0.5)
+
+take(n) returns a NumPy array of n new readings, either one column or one column per channel (all channels have to
+reach the target). Additional readings are requested in blocks sized from the noise seen so far, so the burst and
+buffered acquisitions of the drivers are kept.
+"""
+from running_stats import RunningStats
+import time
+import numpy as np
+
+MAX_SAMPLES = 200  # most readings taken for one adaptive result
+MAX_TIME = 60  # longest time (s) spent adding readings to one adaptive result
+
+
+def samples_needed(stats, target_ppm):
+    """:return: the number of readings expected to bring the standard error of every channel down to target_ppm"""
+    error = np.max(stats.sem_ppm)
+    if not np.isfinite(error):
+        return MAX_SAMPLES
+    return int(np.ceil(stats.n * (error / target_ppm) ** 2))
+
+
+def acquire(take, samples, target_ppm=0.0, max_samples=MAX_SAMPLES, max_time=MAX_TIME, clock=time.perf_counter):
+    """
+    :param take: callable returning a NumPy array of n new readings
+    :param samples: readings taken before the standard error is first checked (the fixed count if target_ppm is 0)
+    :param target_ppm: standard error of the mean at which to stop. 0 takes exactly 'samples' readings
+    :param max_samples: most readings taken
+    :param max_time: longest time (s) spent adding readings beyond the first 'samples'
+    :param clock: time source of the max_time deadline (e.g. VisaClient.clock, so that a replay stops where the
+                  recording did)
+    :return: RunningStats of the readings and a NumPy array of every reading taken
+    """
+    blocks = [take(max(samples, 2) if target_ppm else samples)]
+    stats = RunningStats(blocks[0])
+    deadline = clock() + max_time
+    while target_ppm and stats.n < max_samples and clock() < deadline:
+        if stats.converged(target_ppm):
+            break
+        # an estimate from few readings is itself noisy, so the count grows at most fourfold per block
+        needed = min(samples_needed(stats, target_ppm), 4 * stats.n, max_samples)
+        if needed <= stats.n:
+            break
+        blocks.append(take(needed - stats.n))
+        stats.extend(blocks[-1])
+    return stats, np.concatenate(blocks)
@@ -0,0 +1,68 @@
+"""
+Acquisition plan of a breakpoint table
+
+plan_acquisition runs once over the create_breakpoints table and works out, for every breakpoint, the 8588A digitizer
+settings of its current measurement (get_digitizer_settings: range, filter, aperture, Fs, N, cycles and runtime) and
+its predicted acquisition time. Identical settings share a configuration id, and 'reconfigure' marks the breakpoints
+where the digitizer settings differ from those of the previous digitized breakpoint:
+
+    plan = plan_acquisition(bkpts, samples=5)
+    print(summarize_plan(plan))
+"""
+from dmm_f8588A import get_digitizer_settings, DIGITIZER_SAMPLES
+import numpy as np
+import pandas as pd
+
+READING_TIME = 0.2  # s per reading of the 5790B or an 8588A AC rms reading
+TRANSFER_RATE = 1e6  # bytes/s of a binary buffer transfer
+CONFIG_COLUMNS = ['mode', 'range', 'filter', 'aperture', 'N']
+
+
+def plan_acquisition(bkpts, samples=1, digitized=True, N=DIGITIZER_SAMPLES):
+    """
+    :param bkpts: breakpoint table (voltage, current, frequency, phase)
+    :param samples: readings per measurement that is not digitized
+    :param digitized: plan digitized captures for AC currents (DIGITIZED_AC)
+    :param N: approximate number of samples per capture
+    :return: data frame with the index of bkpts: the digitizer settings (NaN where the current is not digitized),
+             config, reconfigure and predicted (s)
+    """
+    rows = []
+    for _, row in bkpts.iterrows():
+        voltage, current, frequency = row['voltage'], row['current'], row['frequency']
+        settings = {}
+        predicted = samples * READING_TIME if voltage else 0.0
+        if current and digitized and frequency > 0:
+            settings = get_digitizer_settings(frequency, current, 'CURR', N)
+            # the 5790B reads the voltage while the capture is taken
+            predicted = max(predicted, settings['runtime'] + 8 * settings['N'] / TRANSFER_RATE)
+        elif current:
+            predicted = max(predicted, samples * READING_TIME)
+        rows.append({**settings, 'predicted': predicted})
+
+    plan = pd.DataFrame(rows, index=bkpts.index).reindex(columns=[*CONFIG_COLUMNS, 'Fs', 'cycles', 'runtime',
+                                                                   'predicted'])
+    captured = plan['N'].notna()
+    plan['config'] = np.nan
+    plan.loc[captured, 'config'] = plan.loc[captured].groupby(CONFIG_COLUMNS, sort=False).ngroup()
+    previous = plan.loc[captured, 'config'].shift()
+    plan['reconfigure'] = False
+    plan.loc[captured, 'reconfigure'] = plan.loc[captured, 'config'].ne(previous)
+    return plan
+
+
+def get_settings(plan, idx):
+    """:return: the digitizer settings planned for breakpoint idx, or None if its current is not digitized"""
+    row = plan.loc[idx]
+    if pd.isna(row['N']):
+        return None
+    settings = row[[*CONFIG_COLUMNS, 'Fs', 'cycles', 'runtime']].to_dict()
+    settings['N'], settings['cycles'] = int(settings['N']), int(settings['cycles'])
+    return settings
+
+
+def summarize_plan(plan):
+    """:return: one line summary of the predicted acquisition time and digitizer configurations"""
+    configs = plan['config'].nunique()
+    return (f"{len(plan)} breakpoints, predicted acquisition time {plan['predicted'].sum():.1f} s, "
+            f"{configs} digitizer configurations, {int(plan['reconfigure'].sum())} reconfigurations")
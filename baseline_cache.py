@@ -0,0 +1,69 @@
+"""
+On-disk cache of baseline measurements
+
+The single output baselines of a run are saved to a JSON file keyed by the kind of baseline (V or A), its value and
+frequency, the identities of the instruments involved, the wiring state and the acquisition settings (e.g. the sample
+count), so a baseline is only ever the reference of a measurement taken the same way. A later run on the same bench
+reuses every entry younger than the validity window instead of measuring it again. Entries tagged with a run are reused
+by that run whatever their age, which is how a resumed run (see results_writer) keeps the baselines it already measured:
+
+    cache = BaselineCache('results/baselines.json', validity=3600)
+    vref = cache.get('V', voltage, frequency, idn, state, acquisition)
+    if vref is None:
+        vref = measure()
+        cache.put('V', voltage, frequency, idn, state, acquisition, vref)
+"""
+import json
+import os
+import time
+
+
+class BaselineCache:
+    def __init__(self, path, validity=3600):
+        """
+        :param path: JSON file holding the cache (created on the first put)
+        :param validity: age (s) up to which an entry is reused. 0 never reuses entries.
+        """
+        self.path = path
+        self.validity = validity
+        self.entries = {}
+        try:
+            with open(path) as f:
+                self.entries = json.load(f)
+        except FileNotFoundError:
+            pass
+        except (ValueError, OSError) as e:
+            print(f'[WARNING] baseline cache {path} could not be read ({e}). Starting an empty cache.')
+
+    @staticmethod
+    def key(kind, value, frequency, idn, state, acquisition):
+        return f'{kind}|{float(value):.9g}|{float(frequency):.9g}|{idn}|{int(state)}|{acquisition}'
+
+    def get(self, kind, value, frequency, idn, state, acquisition, run=''):
+        """
+        :param acquisition: description of the acquisition settings (e.g. 'samples=5,target_ppm=0.0')
+        :param run: name of the run asking. Its own entries never expire.
+        :return: the cached measurement, or None if it is missing or expired
+        """
+        entry = self.entries.get(self.key(kind, value, frequency, idn, state, acquisition))
+        if entry is None:
+            return None
+        if not (run and entry.get('run') == run) and time.time() - entry['time'] > self.validity:
+            return None
+        return entry['value']
+
+    def put(self, kind, value, frequency, idn, state, acquisition, measurement, run=''):
+        """Stores a measurement taken by run and saves the cache"""
+        key = self.key(kind, value, frequency, idn, state, acquisition)
+        self.entries[key] = {'value': float(measurement), 'time': time.time(), 'run': run}
+        self.save()
+
+    def save(self):
+        # written to a temporary file first, so that an interrupted save never leaves a truncated cache
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temporary = f'{self.path}.tmp'
+        with open(temporary, 'w') as f:
+            json.dump(self.entries, f, indent=1)
+        os.replace(temporary, self.path)
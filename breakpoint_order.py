@@ -0,0 +1,141 @@
+"""
+Execution order of a breakpoint table
+
+create_breakpoints sorts the dual output rows by current and voltage, which says nothing about how long it takes to
+move from one breakpoint to the next. order_breakpoints orders the table by a cost model of those transitions:
+
+    wiring change (show_wiring_dialog)      WIRING_COST
+    compensation switch (set_compensation)  COMPENSATION_COST
+    frequency change                        FREQUENCY_COST
+    5560A output range change (relock)      RELOCK_COST
+    8588A current range change              RANGE_COST
+
+Baselines stay ahead of every dual output point, since each dual point is compared to the baselines of its voltage and
+current. Within the baselines and within the dual points, the rows are grouped by wiring state (each state is wired
+once) and each group is ordered by nearest neighbour followed by 2-opt on the transition costs.
+
+    bkpts, saved = order_breakpoints(bkpts)
+"""
+from dmm_f8588A import get_range, CREST_FACTOR
+import numpy as np
+
+WIRING_COST = 60.0  # s for the operator to rewire
+COMPENSATION_COST = 2.0  # s to switch the distortion amplifier compensation
+FREQUENCY_COST = 1.0  # s for the source to relock to a new frequency
+RELOCK_COST = 1.0  # s for the source to change output range
+RANGE_COST = 0.5  # s for the 8588A to change current range
+SOURCE_RANGES = {'VOLT': [0.012, 0.12, 1.2, 12, 120, 1020], 'CURR': [0.0012, 0.012, 0.12, 1.2, 3.1, 30.2]}
+
+
+def wiring_state(voltage, current):
+    """
+    :return: 0 single output low current, 1 single output high current, 2 dual output low current (including the
+             voltage baselines) or 3 dual output high current
+    """
+    if voltage == 0:
+        return 0 if current <= 3.1 else 1
+    return 2 if current <= 3.1 else 3
+
+
+def source_range(mode, value):
+    ranges = SOURCE_RANGES[mode]
+    return next((r for r in ranges if abs(value) <= r), ranges[-1]) if value else 0.0
+
+
+def get_features(bkpts):
+    """:return: array of (wiring state, compensation, frequency, source V range, source I range, 8588A range) per row"""
+    return np.array([(wiring_state(row['voltage'], row['current']),
+                      row['current'] > 1,
+                      row['frequency'],
+                      source_range('VOLT', row['voltage']),
+                      source_range('CURR', row['current']),
+                      get_range('CURR', row['current'], CREST_FACTOR if row['frequency'] else 1.0)
+                      if row['current'] else 0.0)
+                     for _, row in bkpts.iterrows()], dtype=float).reshape(-1, 6)
+
+
+def transition_costs(a, b, compensation=True):
+    """:return: cost (s) of moving from each breakpoint with features a to each with features b (len(a) x len(b))"""
+    a, b = a[:, None, :], b[None, :, :]
+    weights = np.array([WIRING_COST, COMPENSATION_COST if compensation else 0.0, FREQUENCY_COST,
+                        RELOCK_COST, RELOCK_COST, RANGE_COST])
+    return np.sum((a != b) * weights, axis=-1)
+
+
+def path_cost(features, compensation=True):
+    """:return: the total transition cost (s) of executing the rows in the given order"""
+    if len(features) < 2:
+        return 0.0
+    return float(np.sum(transition_costs(features[:-1], features[1:], compensation).diagonal()))
+
+
+########################################################################################################################
+def _nearest_neighbour(costs, start):
+    # start: the cost of reaching each row from the previous breakpoint (None for the first group of the table)
+    remaining = list(range(len(costs)))
+    current = int(np.argmin(start)) if start is not None else 0
+    order = [current]
+    remaining.remove(current)
+    while remaining:
+        current = remaining[int(np.argmin(costs[current, remaining]))]
+        order.append(current)
+        remaining.remove(current)
+    return order
+
+
+def _two_opt(costs, order, start):
+    """Reverses segments of the open path while that lowers its cost"""
+    order = np.array(order)
+    n = len(order)
+    improved = True
+    while improved and n > 2:
+        improved = False
+        for i in range(n - 1):
+            # reversing order[i..j] replaces the edges (i-1, i) and (j, j+1) with (i-1, j) and (i, j+1). The costs are
+            # symmetric, so the reversed segment itself costs the same
+            j = np.arange(i + 1, n)
+            if i > 0:
+                into = costs[order[i - 1], order[j]] - costs[order[i - 1], order[i]]
+            elif start is not None:
+                into = start[order[j]] - start[order[i]]
+            else:
+                into = np.zeros(len(j))
+            out = np.zeros(len(j))
+            inner = j < n - 1
+            out[inner] = costs[order[i], order[j[inner] + 1]] - costs[order[j[inner]], order[j[inner] + 1]]
+            delta = into + out
+            best = int(np.argmin(delta))
+            if delta[best] < -1e-9:
+                order[i:j[best] + 1] = order[i:j[best] + 1][::-1]
+                improved = True
+    return list(order)
+
+
+def _order_group(features, previous, compensation):
+    costs = transition_costs(features, features, compensation)
+    start = transition_costs(previous[None, :], features, compensation)[0] if previous is not None else None
+    return _two_opt(costs, _nearest_neighbour(costs, start), start)
+
+
+def order_breakpoints(bkpts, compensation=True):
+    """
+    :param bkpts: breakpoint table (voltage, current, frequency, phase)
+    :param compensation: include compensation switches (COMPENSATION_USED) in the costs
+    :return: the reordered table (new index) and the estimated time saved (s) compared to the original order
+    """
+    features = get_features(bkpts)
+    baseline = ((bkpts['voltage'] == 0) | (bkpts['current'] == 0)).to_numpy()
+
+    order = []
+    previous = None
+    for segment in (np.flatnonzero(baseline), np.flatnonzero(~baseline)):
+        states = features[segment, 0]
+        # wire each state once, continuing with the state the previous segment ended in
+        groups = sorted(set(states), key=lambda state: (previous is None or state != previous[0], state))
+        for state in groups:
+            rows = segment[states == state]
+            order += [rows[k] for k in _order_group(features[rows], previous, compensation)]
+            previous = features[order[-1]]
+
+    saved = path_cost(features, compensation) - path_cost(features[order], compensation)
+    return bkpts.iloc[order].reset_index(drop=True), saved
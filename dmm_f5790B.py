@@ -1,34 +1,33 @@
 import VisaClient
+import AsyncVisaClient
+import acquisition
 import time
 import numpy as np
 
 instruments = {'f5790B': {'address': '10.205.92.156', 'port': '3490', 'gpib': '6', 'mode': 'SOCKET'}}
 
-
-########################################################################################################################
-def to_float(s):
-    f = 0.0
-    try:
-        f = float(s)
-    except ValueError:
-        print('[ERROR] Measurement could not be converted to float. Possible issues with configuration.')
-        pass
-    return f
+READING_INTERVAL = 0.2  # longest wait (s) for the 5790B to update its reading
+POLL_INTERVAL = 0.02
+BURST_COMMAND = 'TRIG;*WAI;VAL?'  # one externally triggered reading
 
 
+########################################################################################################################
 class f5790B_instrument:
     def __init__(self):
         super().__init__()
         self.measurement = []
         self.f5790B_IDN = ''
         self.f5790B_connected = False
+        self.f5790B_burst = True  # cleared when the 5790B does not support burst acquisition
+        self.f5790B_samples = 0  # readings used by the last read_voltage
 
     def connect_to_f5790B(self, instr_id):
         # ESTABLISH COMMUNICATION TO INSTRUMENTS -----------------------------------------------------------------------
-        self.f5790B = VisaClient.VisaClient(instr_id)  # Fluke 5790B
+        self.f5790B = VisaClient.get_session(instr_id)  # Fluke 5790B
 
         if self.f5790B.healthy:
             self.f5790B_connected = True
+            self.f5790B_async = AsyncVisaClient.AsyncVisaClient(self.f5790B)
             try:
                 self.f5790B_IDN = self.f5790B.query('*IDN?')
             except ValueError:
@@ -49,42 +48,128 @@ class f5790B_instrument:
         :return:
         """
         # Fluke 5790B --------------------------------------------------------------------------------------------------
-        self.f5790B.write(f'*RST; INPUT {input_terminal}; EXTRIG {EXTRIG}; HIRES {HIRES}; EXTGUARD {EXTGUARD}')
-        time.sleep(1)
+        with self.f5790B.batch(root=False):
+            self.f5790B.write('*RST')
+            self.f5790B.set_state('INPUT', input_terminal)
+            self.f5790B.set_state('EXTRIG', EXTRIG)
+            self.f5790B.set_state('HIRES', HIRES)
+            self.f5790B.set_state('EXTGUARD', EXTGUARD)
+
+    def select_input(self, input_terminal='', dfilt=''):
+        """
+        Selects the input terminal and digital filter. Each is only sent when it changes the 5790B's last known
+        configuration, so this can be called ahead of a measurement (e.g. while the source settles) at no later cost.
+        """
+        with self.f5790B.batch(root=False):
+            if input_terminal and self.f5790B.set_state('INPUT', input_terminal):
+                self.f5790B.write('TRIG')
+            if dfilt:
+                self.f5790B.set_state('DFILT', dfilt)
 
     ####################################################################################################################
-    def read_voltage(self, input_terminal='', samples=1):
-        if input_terminal:
-            self.f5790B.write(f'INPUT {input_terminal}')
-            self.f5790B.write('TRIG')
-            time.sleep(1)
+    def read_voltage(self, input_terminal='', samples=1, burst=True, dfilt='', target_ppm=0.0):
+        """
+        :param input_terminal: selects the active input terminal
+        :param samples: number of readings averaged (the least number when target_ppm is set)
+        :param burst: acquire all readings in as few transactions as possible (see read_voltage_burst). Falls back to
+                      polling VAL? once per reading when the 5790B does not support it.
+        :param dfilt: optional digital filter setting sent as 'DFILT <dfilt>' (e.g. 'SLOW,MEDIUM') before reading
+        :param target_ppm: keep adding readings until the standard error of the mean reaches target_ppm of the mean
+                           (see acquisition.acquire). The number of readings used is kept in f5790B_samples.
+        :return: mean and sample standard deviation of the readings
+        """
+        self.select_input(input_terminal, dfilt)
+
+        stats, _ = acquisition.acquire(lambda count: self._take_voltage(count, burst), samples, target_ppm,
+                                       clock=self.f5790B.clock)
+        self.f5790B_samples = stats.n
+        return stats.mean, stats.std
+
+    def _take_voltage(self, samples, burst=True):
+        readings = None
+        if burst and self.f5790B_burst and samples > 1:
+            readings = self.read_voltage_burst(samples)
+
+        if readings is None:
+            self.f5790B.set_state('EXTRIG', 'OFF')
+            readings = np.zeros(samples)
+            response = ''
+            for idx in range(samples):
+                response = self._next_reading(response)
+                readings[idx] = VisaClient.parse_float(response.partition(',')[0])
+        return readings
 
-        readings = np.zeros(samples)
-        for idx in range(samples):
-            readings[idx] = self.f5790B.query('*WAI;VAL?').split(',')[0]
-            time.sleep(0.2)
+    ####################################################################################################################
+    def read_voltage_burst(self, samples):
+        """
+        Acquires every reading with the 5790B's own trigger system in one program message per max_message_length:
+        with EXTRIG ON, each 'TRIG;*WAI;VAL?' takes exactly one new reading, so there is no polling for fresh readings
+        and no per-reading round trip. EXTRIG stays ON until a polled acquisition turns it off.
 
-        mean = readings.mean()
-        std = np.sqrt(np.mean(abs(readings - mean) ** 2))
-        return mean, std
+        :return: NumPy array of readings, or None if burst acquisition is unavailable (the caller falls back)
+        """
+        per_message = max(self.f5790B.max_message_length // (len(BURST_COMMAND) + 1), 1)
+        readings = []
+        try:
+            self.f5790B.set_state('EXTRIG', 'ON')
+            for start in range(0, samples, per_message):
+                count = min(per_message, samples - start)
+                responses = self.f5790B.query(';'.join([BURST_COMMAND] * count)).split(';')
+                if len(responses) != count:
+                    raise ValueError(f'expected {count} readings, received {len(responses)}')
+                readings += [VisaClient.parse_float(response.partition(',')[0]) for response in responses]
+        except ValueError as e:
+            print(f'[5790B] burst acquisition unavailable ({e}). Falling back to polled readings.')
+            self.f5790B_burst = False
+            return None
+        return np.array(readings)
+
+    def trigger_voltage(self, previous=''):
+        """
+        Takes one new reading for acquisitions paced by the caller (see Instruments.read_dual). With EXTRIG ON the
+        reading is triggered by the command itself, otherwise the next updated VAL? reading is returned.
+
+        :return: time (VisaClient.clock) at the middle of the transaction and the raw VAL? response
+        """
+        start = self.f5790B.clock()
+        if self.f5790B.shadow.get('EXTRIG') == 'ON':
+            response = self.f5790B.query(BURST_COMMAND)
+        else:
+            self.f5790B.set_state('EXTRIG', 'OFF')
+            response = self._next_reading(previous)
+        return (start + self.f5790B.clock()) / 2, response
+
+    def _next_reading(self, previous=''):
+        """
+        VAL? returns the most recent reading. Rather than sleeping a fixed interval between samples, poll until the
+        5790B reports a reading different from the previous one, waiting no longer than READING_INTERVAL.
+        """
+        deadline = self.f5790B.clock() + READING_INTERVAL
+        response = self.f5790B.query('*WAI;VAL?')
+        while response == previous and self.f5790B.clock() < deadline:
+            time.sleep(POLL_INTERVAL)
+            response = self.f5790B.query('*WAI;VAL?')
+        return response
 
     ####################################################################################################################
+    async def read_voltage_async(self, input_terminal='', samples=1, burst=True, dfilt='', target_ppm=0.0):
+        return await self.f5790B_async.call(self.read_voltage, input_terminal, samples, burst, dfilt, target_ppm)
+
     def close_f5790B(self):
+        # the session itself stays open in the VisaClient session pool for the next run
         if self.f5790B_connected:
-            time.sleep(1)
-            self.f5790B.close()
+            self.f5790B_async.close()
             self.f5790B_connected = False
 
 
 # Run
 if __name__ == "__main__":
-    output, mode = 'VOLT', 'AC'
     instr = f5790B_instrument()
 
-    instr.connect_to_f5790B(instruments)
-    instr.setup_f5790B(output, mode)
+    instr.connect_to_f5790B(instruments['f5790B'])
+    instr.setup_f5790B()
 
     mean, std = instr.read_voltage(input_terminal='INPUT2', samples=15)
-    print(f"\nVoltage: {mean}\nStandard Deviation: {std} Hz")
+    print(f"\nVoltage: {mean}\nStandard Deviation: {std} V")
 
-    instr.setup_f5790B()
+    instr.close_f5790B()
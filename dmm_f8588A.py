@@ -1,19 +1,62 @@
 import VisaClient
+import AsyncVisaClient
+import acquisition
+import sine_fit
+from running_stats import RunningStats
 import time
 import numpy as np
 
 instruments = {'f8588A': {'address': '10.205.92.156', 'port': '3490', 'gpib': '6', 'mode': 'SOCKET'}}
 
+READING_TIMEOUT = 30  # longest wait (s) for a triggered measurement to complete
+DIGITIZER_SAMPLES = 20000  # samples per digitized capture
+DIGITIZER_CAPTURE = 0.5  # approximate duration (s) of a digitized capture
+DIGITIZER_CYCLES = 4  # fewest cycles captured
+DIGITIZER_SAMPLES_PER_CYCLE = 20  # fewest samples per cycle (limits the cycles captured at high frequencies)
+DIGITIZER_RANGES = {'CURR': [10e-6, 100e-6, 1e-3, 10e-3, 100e-3, 1, 10, 30], 'VOLT': [0.1, 1, 10, 100, 1000]}
+DIGITIZER_FILTERS = [(100e3, '100KHZ'), (3e6, '3MHZ')]  # (bandwidth, setting) of the digitizer filters
+CREST_FACTOR = np.sqrt(2)  # peak to rms ratio of a sine wave
+
 
 ########################################################################################################################
-def to_float(s):
-    f = 0.0
-    try:
-        f = float(s)
-    except ValueError:
-        print('[ERROR] Measurement could not be converted to float. Possible issues with configuration.')
-        pass
-    return f
+def get_range(mode, rms, crest=CREST_FACTOR):
+    """
+    Digitized samples reach the peak of the signal, so a range chosen on the rms value alone would clip any sine wave
+    above 0.707 of the range.
+
+    :param crest: peak to rms ratio of the signal (1 for DC)
+    :return: the smallest digitizer range (CURR or VOLT) that holds the peak of a signal of value rms
+    """
+    ranges = DIGITIZER_RANGES[mode]
+    return next((r for r in ranges if abs(rms) * crest <= r), ranges[-1])
+
+
+def get_cycles(Ft, N=DIGITIZER_SAMPLES, capture=DIGITIZER_CAPTURE):
+    """
+    :return: the whole number of cycles of Ft closest to a capture of 'capture' seconds, at least DIGITIZER_CYCLES and
+             no more than leaves DIGITIZER_SAMPLES_PER_CYCLE samples per cycle
+    """
+    return max(min(round(Ft * capture), N // DIGITIZER_SAMPLES_PER_CYCLE), DIGITIZER_CYCLES)
+
+
+def get_filter(Fs):
+    """:return: the widest digitizer filter whose bandwidth is within the Nyquist frequency (the narrowest otherwise)"""
+    fitting = [setting for bandwidth, setting in DIGITIZER_FILTERS if bandwidth <= Fs / 2]
+    return fitting[-1] if fitting else DIGITIZER_FILTERS[0][1]
+
+
+def get_digitizer_settings(Ft, rms, mode='CURR', N=DIGITIZER_SAMPLES):
+    """
+    Settings of a digitized capture of a signal of frequency Ft and value rms. The sample count is adjusted so that the
+    capture spans exactly 'cycles' periods of Ft at the sample rate get_aperture actually achieves.
+
+    :return: dict of mode, range, filter, aperture, Fs, N, cycles and runtime (s)
+    """
+    cycles = get_cycles(Ft, N)
+    aperture, Fs, _ = get_aperture(Ft, N, cycles)
+    N = max(round(cycles * Fs / Ft), 2)
+    return {'mode': mode, 'range': get_range(mode, rms), 'filter': get_filter(Fs), 'aperture': aperture, 'Fs': Fs,
+            'N': N, 'cycles': cycles, 'runtime': N / Fs}
 
 
 def get_aperture(Ft, N, cycles):
@@ -72,13 +115,19 @@ class f8588A_instrument:
 
         self.mode = 'VOLT'  # VOLT or CURR
         self.function = 'DC'  # DC or AC
+        self.digitizer_count = 0
+        self.f8588A_buffered = True  # cleared when the 8588A does not return a buffer of readings
+        self.f8588A_samples = 0  # readings used by the last read_f8588A
+        self.f8588A_phase = 0.0  # phase (deg) of the last digitized capture relative to its trigger
+        self.f8588A_thd = 0.0  # total harmonic distortion (ratio) of the last digitized capture
 
     def connect_to_f8588A(self, instr_id):
         # ESTABLISH COMMUNICATION TO INSTRUMENTS -----------------------------------------------------------------------
-        self.f8588A = VisaClient.VisaClient(instr_id)  # Fluke 8588A
+        self.f8588A = VisaClient.get_session(instr_id)  # Fluke 8588A
 
         if self.f8588A.healthy:
             self.f8588_connected = True
+            self.f8588A_async = AsyncVisaClient.AsyncVisaClient(self.f8588A)
             try:
                 self.f8588A_IDN = self.f8588A.query('*IDN?')
             except ValueError:
@@ -106,10 +155,7 @@ class f8588A_instrument:
         """
         self.mode = mode
         self.function = function
-
-        self.f8588A.write(f'CONF:{mode}:{function}')
-        self.f8588A.write(f'{mode}:{function}:RANGE:AUTO ON')
-        time.sleep(0.5)
+        self._configure_f8588A()
 
     ####################################################################################################################
     def set_f8588A_function(self, frequency=0.0):
@@ -117,70 +163,219 @@ class f8588A_instrument:
             self.function = 'AC'
         else:
             self.function = 'DC'
+        self._configure_f8588A()
 
-        self.f8588A.write(f'CONF:{self.mode}:{self.function}')
-        self.f8588A.write(f'{self.mode}:{self.function}:RANGE:AUTO ON')
-        time.sleep(0.5)
+    def _configure_f8588A(self):
+        # only the commands that change the 8588A's last known configuration are sent (see VisaClient.set_state)
+        with self.f8588A.batch():
+            if self.f8588A.set_state('CONF', f'{self.mode}:{self.function}', f'CONF:{self.mode}:{self.function}'):
+                # CONF also returns the trigger system to its defaults
+                self.f8588A.invalidate(f'{self.mode}:{self.function}:')
+                self.f8588A.invalidate('TRIGger:')
+            self.f8588A.set_state(f'{self.mode}:{self.function}:RANGE:AUTO', 'ON')
 
     ####################################################################################################################
-    def read_f8588A(self, mode='', function='', samples=1):
-        freqval = 0.0
-        time.sleep(1)
-        if output and mode:
+    def read_f8588A(self, mode='', function='', samples=1, buffered=True, target_ppm=0.0):
+        """
+        :param mode: optional CURRent or VOLTage to configure before reading
+        :param function: optional AC or DC to configure before reading
+        :param samples: number of readings averaged (the least number when target_ppm is set)
+        :param buffered: take all readings with a single trigger (see read_f8588A_buffered). Falls back to one
+                         triggered reading per sample when the 8588A does not return a buffer.
+        :param target_ppm: keep adding readings until the standard error of the mean reaches target_ppm of the mean
+                           (see acquisition.acquire). The number of readings used is kept in f8588A_samples.
+        :return: mean, range, frequency and sample standard deviation of the readings
+        """
+        if mode and function:
             self.setup_f8588A(mode=mode, function=function)
-        self.f8588A.write('INIT:IMM')
+        else:
+            self._configure_f8588A()  # after a digitized capture
+
+        stats, _ = acquisition.acquire(lambda count: self._take_f8588A(count, buffered), samples, target_ppm,
+                                       clock=self.f8588A.clock)
+        self.f8588A_samples = stats.n
+
+        dmm_range, freqval = self._range_and_frequency()
+        return stats.mean, dmm_range, freqval, stats.std
+
+    def _take_f8588A(self, samples, buffered=True):
+        if buffered and self.f8588A_buffered and samples > 1:
+            readings = self._read_buffer(samples)
+            if readings is not None:
+                return readings
 
         # Primary result = 1 (page 17 of 8588A's programmers manual)
         # A return of 9.91E+37 indicates there is not a valid value to return (NaN - not a number)
-        # time delay prevents NaN result
+        # waiting for the triggered reading to complete prevents NaN result
 
+        self.f8588A.set_state('TRIGger:COUNt', 1)
         readings = np.zeros(samples)
         for idx in range(samples):
-            self.f8588A.write('INIT:IMM')
-            time.sleep(0.2)
-            readings[idx] = to_float(self.f8588A.query('FETCH? 1'))
-            time.sleep(0.2)
+            readings[idx] = self._trigger_reading()
+        return readings
+
+    def _trigger_reading(self):
+        """Triggers one reading and fetches it once it completes"""
+        if not self.f8588A.wait_complete(READING_TIMEOUT, 'INIT:IMM'):
+            raise ValueError(f'reading did not complete within {READING_TIMEOUT} s')
+        return self.f8588A.query_float('FETCH? 1')
 
-        outval = readings.mean()
-        std = np.sqrt(np.mean(abs(readings - outval) ** 2))
+    def read_f8588A_buffered(self, mode='', function='', samples=1, binary=False):
+        """
+        Takes every reading from one trigger: TRIGger:COUNt is set once, a single INIT starts the acquisition and the
+        whole buffer is fetched in one transfer (optionally as a binary block).
 
-        dmm_range = to_float(self.f8588A.query(f'{output}:{mode}:RANGE?'))
+        :return: readings (NumPy array), mean, range, frequency and sample standard deviation, or None if the 8588A did
+                 not return the expected number of readings (the caller falls back)
+        """
+        if mode and function:
+            self.setup_f8588A(mode=mode, function=function)
+        else:
+            self._configure_f8588A()
 
-        if mode == 'AC':
+        readings = self._read_buffer(samples, binary)
+        if readings is None:
+            return None
+
+        stats = RunningStats(readings)
+        dmm_range, freqval = self._range_and_frequency()
+        return readings, stats.mean, dmm_range, freqval, stats.std
+
+    def trigger_f8588A(self):
+        """
+        Takes one triggered reading for acquisitions paced by the caller (see Instruments.read_dual).
+
+        :return: time (VisaClient.clock) at the middle of the transaction and the primary reading
+        """
+        self._configure_f8588A()
+        self.f8588A.set_state('TRIGger:COUNt', 1)
+        start = self.f8588A.clock()
+        reading = self._trigger_reading()
+        return (start + self.f8588A.clock()) / 2, reading
+
+    def _read_buffer(self, samples, binary=False):
+        try:
+            self.f8588A.set_state('TRIGger:COUNt', samples)
+            readings = self._fetch_buffer(samples, READING_TIMEOUT * samples, binary)
+        except ValueError as e:
+            readings = None
+            print(f'[8588A] buffered acquisition failed ({e})')
+
+        if readings is None or len(readings) != samples:
+            print('[8588A] buffered acquisition unavailable. Falling back to one trigger per reading.')
+            self.f8588A_buffered = False
+            return None
+        return readings
+
+    def _range_and_frequency(self):
+        freqval = 0.0
+        dmm_range = self.f8588A.query_float(f'{self.mode}:{self.function}:RANGE?')
+
+        if self.function == 'AC':
             # FREQuency = 2 (page 17 of 8588A's programmers manual)
-            freqval = to_float(self.f8588A.query('FETCH? 2'))
+            freqval = self.f8588A.query_float('FETCH? 2')
+        return dmm_range, freqval
+
+    async def read_f8588A_async(self, mode='', function='', samples=1, buffered=True, target_ppm=0.0):
+        return await self.f8588A_async.call(self.read_f8588A, mode, function, samples, buffered, target_ppm)
 
-        return outval, dmm_range, freqval, std
+    ####################################################################################################################
+    def read_f8588A_digitized(self, Ft, rms=0.0, mode='', N=DIGITIZER_SAMPLES, settings=None):
+        """
+        Measures an AC signal from one digitized capture of a whole number of cycles instead of a series of AC RMS
+        readings (see get_digitizer_settings). The digitizer is left configured, so consecutive captures with the same
+        settings send no configuration commands; the other read methods return the 8588A to its CONF configuration.
+
+        :param Ft: nominal frequency of the signal (Hz)
+        :param rms: expected rms value used to pick the range (the last measured range if 0)
+        :param mode: CURR or VOLT (the configured mode by default)
+        :param N: approximate number of samples
+        :param settings: precomputed get_digitizer_settings (e.g. from an acquisition plan)
+        :return: rms, range, frequency and standard deviation of the rms (the rms residual of the sine fit over
+                 sqrt(N)). The phase of the signal relative to the trigger is kept in f8588A_phase and its THD in
+                 f8588A_thd.
+        """
+        if settings is None:
+            rms = rms or self.f8588A.query_float(f'{self.mode}:{self.function}:RANGE?')
+            settings = get_digitizer_settings(Ft, rms, mode or self.mode, N)
+        oper_range, Fs, N = settings['range'], settings['Fs'], settings['N']
+
+        self.setup_digitizer('A' if settings['mode'] == 'CURR' else 'V', oper_range, settings['filter'], N,
+                             settings['aperture'])
+        samples = self.retrieve_digitize(binary=True, timeout=READING_TIMEOUT + settings['runtime'])
+
+        self.f8588A_samples = len(samples)
+        amplitude, phase, offset, freqval, residual = sine_fit.fit4(samples, Fs, Ft)
+        self.f8588A_phase = np.degrees(phase)
+        self.f8588A_thd = sine_fit.fft_analysis(samples, Fs)[2]
+
+        # the fundamental from the fit does not depend on the capture spanning exactly whole cycles. The residual
+        # holds the harmonics and noise. The capture rarely holds a whole number of samples per cycle, so rms values of
+        # single cycles would vary with where each cycle is cut. The spread comes from the residual instead
+        outval = np.sqrt(amplitude ** 2 / 2 + residual ** 2)
+        std = residual / np.sqrt(len(samples))
+        return outval, oper_range, freqval, std
+
+    async def read_f8588A_digitized_async(self, Ft, rms=0.0, mode='', N=DIGITIZER_SAMPLES, settings=None):
+        return await self.f8588A_async.call(self.read_f8588A_digitized, Ft, rms, mode, N, settings)
 
     ####################################################################################################################
     def setup_digitizer(self, mode, oper_range, filter_val, N, aperture):
         # f8588A has a 5MHz sampled rate clock. adjusting aperture time, averages more points, which adjusts sample rate
-        self.f8588A.write('*RST')
-        if mode in ('A', 'a'):
-            self.f8588A.write(':FUNC "DIGitize:CURRent" ')
-            self.f8588A.write(f':DIGitize:CURRent:RANGe {oper_range}')
-        else:
-            self.f8588A.write(':FUNC "DIGitize:VOLTage" ')
-            self.f8588A.write(f':DIGitize:VOLTage:RANGe {oper_range}')
-        self.f8588A.write(f':DIGitize:FILTer {filter_val}')
-        self.f8588A.write(f':DIGitize:APERture {aperture}')
-        self.f8588A.write('TRIGger:RESet')
-        self.f8588A.write(f'TRIGGER:COUNT {N}')
-        self.f8588A.write('TRIGger:DELay:AUTO OFF')
-        self.f8588A.write('TRIGGER:DELay 0')
-
-    def retrieve_digitize(self):
-        self.f8588A.write('INIT:IMM')
-        time.sleep(5)
-        read = self.f8588A.query('FETCH?')
-        buffer = [float(i) for i in read.split(',')]
-        return buffer
+        # the configuration is sent as a single pipelined transaction with one completion check. Only settings that
+        # differ from the 8588A's last known configuration are sent (see VisaClient.set_state)
+        function = 'DIGitize:CURRent' if mode in ('A', 'a') else 'DIGitize:VOLTage'
+        with self.f8588A.batch():
+            self.f8588A.set_state('CONF', function, f':FUNC "{function}"')
+            self.f8588A.set_state(f'{function}:RANGe', oper_range, f':{function}:RANGe {oper_range}')
+            self.f8588A.set_state('DIGitize:FILTer', filter_val, f':DIGitize:FILTer {filter_val}')
+            self.f8588A.set_state('DIGitize:APERture', aperture, f':DIGitize:APERture {aperture}')
+            self.f8588A.set_state('TRIGger:COUNt', N)
+            self.f8588A.set_state('TRIGger:DELay:AUTO', 'OFF')
+            self.f8588A.set_state('TRIGger:DELay', 0)
+        self.digitizer_count = N
+
+    def retrieve_digitize(self, binary=True, chunk=None, timeout=READING_TIMEOUT):
+        """
+        Triggers the digitizer and returns the captured buffer.
+
+        :param binary: transfer the buffer as IEEE 488.2 REAL,64 blocks decoded straight into a NumPy array
+        :param chunk: the most readings fetched per transfer. Larger buffers are fetched in chunks using
+                      TRACe:DATA? <start>,<count>
+        :param timeout: longest wait (s) for the capture to complete
+        :return: NumPy array of readings
+        """
+        return self._fetch_buffer(self.digitizer_count, timeout, binary, chunk)
+
+    def _fetch_buffer(self, N, timeout, binary=True, chunk=None):
+        """Triggers the configured acquisition of N readings and fetches the buffer once it completes"""
+        if not self.f8588A.wait_complete(timeout, 'INIT:IMM'):
+            raise ValueError(f'acquisition of {N} readings did not complete within {timeout} s')
+
+        if not binary:
+            return self.f8588A.query_floats('FETCH?')
+
+        with self.f8588A.batch():
+            self.f8588A.write('FORMat:DATA REAL,64')
+            self.f8588A.write('FORMat:BORDer NORMal')
+        try:
+            if not chunk or chunk >= N:
+                return self.f8588A.query_binary('FETCH?')
+
+            buffer = np.empty(N)
+            for start in range(0, N, chunk):
+                count = min(chunk, N - start)
+                buffer[start:start + count] = self.f8588A.query_binary(f'TRACe:DATA? {start + 1}, {count}')
+            return buffer
+        finally:
+            # every other query of the driver expects ASCII responses
+            self.f8588A.write('FORMat:DATA ASCii')
 
     ####################################################################################################################
     def close_f8588A(self):
+        # the session itself stays open in the VisaClient session pool for the next run
         if self.f8588_connected:
-            time.sleep(1)
-            self.f8588A.close()
+            self.f8588A_async.close()
             self.f8588_connected = False
 
 
@@ -189,10 +384,10 @@ if __name__ == "__main__":
     output, mode = 'VOLT', 'AC'
     instr = f8588A_instrument()
 
-    instr.connect_to_f8588A(instruments)
+    instr.connect_to_f8588A(instruments['f8588A'])
     instr.setup_f8588A(output, mode)
 
-    outval, dmm_range, freqval = instr.read_f8588A(mode)
+    outval, dmm_range, freqval, std = instr.read_f8588A()
     print(f"\nOutput: {outval}\nFrequency: {freqval} Hz")
 
     instr.close_f8588A()
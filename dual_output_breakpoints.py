@@ -114,3 +114,57 @@ def create_breakpoints(file):
     bkpts = pd.concat([top_df, btm_df_sorted], sort=False)
 
     return bkpts
+
+
+def required_baselines(df):
+    """
+    :param df: breakpoint table
+    :return: the sets of (voltage, frequency) and (current, frequency) baselines referenced by its dual output rows
+    """
+    dual = df[(df['voltage'] != 0) & (df['current'] != 0)]
+    return set(zip(dual['voltage'], dual['frequency'])), set(zip(dual['current'], dual['frequency']))
+
+
+def check_baselines(df):
+    """
+    Raises a ValueError listing the baselines that the dual output rows of the table reference but that it does not
+    measure, so that a run fails before any instrument is touched instead of part way through.
+    :param df: breakpoint table
+    """
+    voltages, currents = required_baselines(df)
+    measured_voltages = set(zip(df.loc[df['current'] == 0, 'voltage'], df.loc[df['current'] == 0, 'frequency']))
+    measured_currents = set(zip(df.loc[df['voltage'] == 0, 'current'], df.loc[df['voltage'] == 0, 'frequency']))
+    missing = [f'{v}V, {f}Hz' for v, f in sorted(voltages - measured_voltages)]
+    missing += [f'{i}A, {f}Hz' for i, f in sorted(currents - measured_currents)]
+    if missing:
+        raise ValueError(f'breakpoint table is missing {len(missing)} baselines: {"; ".join(missing)}')
+
+
+def schedule_baselines(df):
+    """
+    Keeps exactly the single output rows that the dual output rows need: baselines no dual output row references are
+    dropped and referenced baselines missing from the table (e.g. removed by apply_user_limits) are added after the
+    baselines that are kept.
+    :param df: breakpoint table
+    :return: the new table (baselines first) and the number of baselines dropped and added
+    """
+    voltages, currents = required_baselines(df)
+    voltage_baseline = df['current'] == 0
+    current_baseline = df['voltage'] == 0
+    dual = df[~voltage_baseline & ~current_baseline]
+
+    keys = pd.Series(list(zip(df['voltage'], df['frequency'])), index=df.index)
+    keep_voltages = voltage_baseline & keys.isin(voltages)
+    keys = pd.Series(list(zip(df['current'], df['frequency'])), index=df.index)
+    keep_currents = current_baseline & keys.isin(currents)
+    kept = df[keep_voltages | keep_currents].drop_duplicates(subset=['voltage', 'current', 'frequency'])
+
+    present_voltages = set(zip(kept.loc[kept['current'] == 0, 'voltage'], kept.loc[kept['current'] == 0, 'frequency']))
+    present_currents = set(zip(kept.loc[kept['voltage'] == 0, 'current'], kept.loc[kept['voltage'] == 0, 'frequency']))
+    added = pd.DataFrame([(v, 0.0, f, 0.0) for v, f in sorted(voltages - present_voltages)]
+                         + [(0.0, i, f, 0.0) for i, f in sorted(currents - present_currents)],
+                         columns=['voltage', 'current', 'frequency', 'phase'], dtype=float)
+
+    bkpts = pd.concat([kept, added, dual], sort=False).reset_index(drop=True)
+    dropped = int((voltage_baseline | current_baseline).sum()) - len(kept)
+    return bkpts, dropped, len(added)
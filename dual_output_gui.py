@@ -13,6 +13,7 @@ import os
 import csv
 import sys
 import threading
+import argparse
 
 
 class TestFrame(wx.Frame):
@@ -34,6 +35,7 @@ class TestFrame(wx.Frame):
         self.x, self.y = [0.], [[0.]]
         self.flag_complete = False
         self.prompt = True
+        self.resume = None  # results file of an interrupted run for the next run to continue (see Test.run)
 
         self.panel_1 = wx.Panel(self, wx.ID_ANY)
         self.panel_2 = wx.Panel(self.panel_1, wx.ID_ANY)
@@ -78,7 +80,7 @@ class TestFrame(wx.Frame):
         self.text_ctrl_7.SetMinSize((50, 23))
         self.text_ctrl_8.SetMinSize((50, 23))
         self.text_ctrl_12.SetMinSize((50, 23))
-        self.grid_1.CreateGrid(30, 12)
+        self.grid_1.CreateGrid(30, 15)
         # end wxGlade
 
     def __do_layout(self):
@@ -175,7 +177,9 @@ class TestFrame(wx.Frame):
         self.flag_complete = False
 
         test = Test(self)
-        self.thread = threading.Thread(target=test.run, args=(self.get_values(),))
+        params = self.get_values()
+        self.resume = None  # only the first run continues the interrupted one
+        self.thread = threading.Thread(target=test.run, args=(params,))
         self.thread.start()
 
     def toggle_ctrl(self):
@@ -222,13 +226,33 @@ class TestFrame(wx.Frame):
                 'imin': float(self.text_ctrl_3.GetValue()), 'imax': float(self.text_ctrl_4.GetValue()),
                 'fmin': float(self.text_ctrl_5.GetValue()), 'fmax': float(self.text_ctrl_6.GetValue()),
                 'pmin': float(self.text_ctrl_7.GetValue()), 'pmax': float(self.text_ctrl_8.GetValue()),
-                'samples': int(self.text_ctrl_12.GetValue())}
+                'samples': int(self.text_ctrl_12.GetValue()), 'resume': self.resume}
 
     def set_ident(self, idn_dict):
         self.text_ctrl_9.SetValue(idn_dict['UUT'])  # UUT
         self.text_ctrl_10.SetValue(idn_dict['DMM01'])  # current f8588A
         self.text_ctrl_11.SetValue(idn_dict['DMM02'])  # voltage f8588A
 
+    def set_health(self, report):
+        wx.CallAfter(self._show_health, report)
+
+    def _show_health(self, report):
+        ctrls = {'UUT': self.text_ctrl_9, 'DMM01': self.text_ctrl_10, 'DMM02': self.text_ctrl_11}
+        failed = []
+        for role, status in report.items():
+            if status['healthy']:
+                ctrls[role].SetValue(status['idn'])
+            else:
+                ctrls[role].SetValue('NOT CONNECTED')
+                failed.append(f"{status['instrument']} ({status['resource']}): {status['error'] or 'timed out'}")
+        if failed:
+            self.error_dialog('Unable to connect to:\n' + '\n'.join(failed))
+
+    def error_dialog(self, error_message):
+        print(error_message)
+        dial = wx.MessageDialog(None, str(error_message), 'Error', wx.OK | wx.ICON_ERROR)
+        dial.ShowModal()
+
     def show_wiring_dialog(self, state):
         wx.CallAfter(self._open_dialog, state)
         while self.prompt:
@@ -328,7 +352,13 @@ class MyApp(wx.App):
 
 
 def main():
+    parser = argparse.ArgumentParser(description='Dual output test')
+    parser.add_argument('--resume', nargs='?', const='latest',
+                        help='continue an interrupted run from its results file (default: the most recent one)')
+    args = parser.parse_args()
+
     app = MyApp(0)
+    app.get_test_frame().resume = args.resume
     app.MainLoop()
 
 
@@ -2,23 +2,41 @@ from dmm_f8588A import *
 from dmm_f5790B import *
 from dut_f5560A import *
 from dual_output_breakpoints import *
-
+from latency_stats import LATENCY
+import VisaClient
+import acquisition
+from settling import SettlingDetector, SETTLE_WINDOW, SETTLE_PPM
+from acquisition_plan import plan_acquisition, get_settings, summarize_plan
+from breakpoint_order import order_breakpoints, wiring_state
+from baseline_cache import BaselineCache
+from results_writer import ResultsWriter, load_results, latest_results
+
+import asyncio
 import time
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import pandas as pd
 
 # [PARAMETERS] #########################################################################################################
 LOWS_TIED = True
 COMPENSATION_USED = False
+CONNECT_DEADLINE = 120  # seconds allowed for all connection attempts to one instrument
+LATENCY_STATS = True  # record the round trip time of every command and save them alongside the results
+TARGET_PPM = 0.0  # add readings until the standard error of each mean reaches this (ppm). 0 uses a fixed count
+DIGITIZED_AC = False  # measure AC current from one digitized capture (read_f8588A_digitized)
+OPTIMIZE_ORDER = True  # reorder the breakpoints to minimize wiring, compensation, frequency and range changes
+BASELINE_CACHE = 'results/baselines.json'  # baseline measurements shared between runs
+BASELINE_VALIDITY = 3600  # age (s) up to which a cached baseline is reused. 0 measures every baseline
+
+INSTRUMENTS = {'f5560A': {'address': '129.196.136.130', 'port': '3490', 'gpib': '4', 'mode': 'GPIB'},
+               'f8588A': {'address': '10.205.92.241', 'port': '3490', 'gpib': '24', 'mode': 'GPIB'},
+               'f5790B': {'address': '', 'port': '', 'gpib': '6', 'mode': 'GPIB'}}
 
 
 def get_measurement_length(df):
-    # https://stackoverflow.com/a/15943975
-    size = len(df.index)
-    pos1 = df['voltage'].ne(0).idxmax()
-    pos2 = df['current'].iloc[pos1:].ne(0).idxmax()
-    return size - pos2
+    # the number of dual output points (every row that is not a baseline), in whatever order the rows are
+    return int((df['voltage'].ne(0) & df['current'].ne(0)).sum())
 
 
 ########################################################################################################################
@@ -30,47 +48,211 @@ class Instruments(f5560A_instrument, f8588A_instrument, f5790B_instrument):
         self.measurement = []
         self.connected = False
 
-        self.M = Instruments(self)
+    def connect(self, instruments=None):
+        """
+        Connects to all instruments in parallel, so an unreachable instrument no longer delays the others. Each
+        instrument gets CONNECT_DEADLINE seconds for all of its connection attempts unless its id sets 'deadline'.
+        The frame receives one aggregated health report.
+        """
+        instruments = instruments or INSTRUMENTS
+        roles = {'UUT': ('f5560A', self.connect_to_f5560A),
+                 'DMM01': ('f8588A', self.connect_to_f8588A),
+                 'DMM02': ('f5790B', self.connect_to_f5790B)}
+
+        # ESTABLISH COMMUNICATION TO INSTRUMENTS -----------------------------------------------------------------------
+        with ThreadPoolExecutor(max_workers=len(roles)) as executor:
+            futures = {role: executor.submit(connect, {'deadline': CONNECT_DEADLINE, **instruments[key]})
+                       for role, (key, connect) in roles.items()}
+
+        report = {}
+        for role, (key, connect) in roles.items():
+            client = getattr(self, key, None)
+            error = futures[role].exception()
+            report[role] = {'instrument': key,
+                            'resource': VisaClient.resource_name(instruments[key]),
+                            'healthy': bool(client and client.healthy and not error),
+                            'idn': getattr(client, 'idn', ''),
+                            'elapsed': getattr(client, 'connect_time', 0.0),
+                            'error': f'{error}' if error else getattr(client, 'connect_error', '')}
+        self.analyzer.frame.set_health(report)
+
+        if all(status['healthy'] for status in report.values()):
+            self.connected = True
+            try:
+                idn_dict = {'UUT': self.f5560A_IDN, 'DMM01': self.f8588A_IDN, 'DMM02': self.f5790B_IDN}
+                self.analyzer.frame.set_ident(idn_dict)
+                self.setup_source()
+            except ValueError:
+                raise ValueError('Could not connect. Timeout error occurred.')
+        else:
+            print('\nUnable to connect to all instruments.\n')
+        return report
+
+    def read_dual(self, input_terminal='INPUT2', samples=1, target_ppm=0.0):
+        """
+        Samples the 5790B (voltage) and 8588A (current) in parallel. Both DMMs are armed once for each block of
+        readings and return it in a single transfer (see read_dual_buffered_async), so the measurement window is half
+        that of reading the two DMMs one after the other and a block costs a few round trips instead of two per pair.
+
+        The two DMMs cover the same measurement window but are not triggered together, so the n-th voltage and current
+        readings are not simultaneous. Only the statistics of each column are meaningful, not the individual pairs.
+
+        :param target_ppm: keep adding pairs of readings until the standard error of both means reaches target_ppm
+                           (see acquisition.acquire)
+        :return: voltage readings, current readings and the RunningStats of the [voltage, current] readings
+        """
+        def take(count):
+            volts, amps = asyncio.run(self.read_dual_buffered_async(input_terminal, count))
+            return np.column_stack((volts, amps))
+
+        stats, readings = acquisition.acquire(take, samples, target_ppm, clock=self.f8588A.clock)
+        self.f5790B_samples = self.f8588A_samples = stats.n
+        return readings[:, 0], readings[:, 1], stats
+
+    def measure_dual(self, input_terminal='INPUT2', samples=1, target_ppm=0.0, frequency=0.0, settings=None):
+        """
+        Measures the voltage and current of a dual output point, either as parallel paired readings (read_dual) or,
+        given digitizer settings (see acquisition_plan), a digitized capture of the AC current taken while the 5790B
+        reads the voltage.
+
+        :return: voltage, voltage standard deviation, current and current standard deviation
+        """
+        if settings is not None:
+            async def measure():
+                return await asyncio.gather(self.read_voltage_async(input_terminal, samples, target_ppm=target_ppm),
+                                            self.read_f8588A_digitized_async(frequency, settings=settings))
+            (Vmeas, VOLT_STD), (Imeas, _, _, CUR_STD) = asyncio.run(measure())
+            return Vmeas, VOLT_STD, Imeas, CUR_STD
+
+        stats = self.read_dual(input_terminal, samples, target_ppm)[2]
+        return stats.mean[0], stats.std[0], stats.mean[1], stats.std[1]
+
+    async def read_dual_buffered_async(self, input_terminal='INPUT2', samples=1):
+        """
+        Arms both DMMs once for all the readings: the 5790B takes them as a burst (read_voltage_burst) while the 8588A
+        takes them from a single trigger with TRIGger:COUNt samples (see read_f8588A_buffered), and each returns its
+        readings in one transfer. Falls back to one trigger per pair of readings (read_dual_async) when either DMM does
+        not support it.
+
+        The readings of a burst and of a buffered trigger are not timestamped, so none are returned. The 5790B burst
+        and the 8588A trigger start within a bus transfer of each other but run on their own timebases, so readings
+        with the same index are not time-aligned.
+
+        :return: voltage readings and current readings
+        """
+        if samples > 1 and self.f5790B_burst and self.f8588A_buffered:
+            await asyncio.gather(self.f5790B_async.call(self.select_input, input_terminal),
+                                 self.f8588A_async.call(self._configure_f8588A))
+            volts, amps = await asyncio.gather(self.f5790B_async.call(self.read_voltage_burst, samples),
+                                               self.f8588A_async.call(self._read_buffer, samples))
+            if volts is not None and amps is not None:
+                return volts, amps
+        volts, amps, _ = await self.read_dual_async(input_terminal, samples)
+        return volts, amps
+
+    async def read_dual_async(self, input_terminal='INPUT2', samples=1, stop=None):
+        """
+        Takes pairs of readings one trigger at a time, for acquisitions that look at every pair as it arrives (see
+        wait_settled).
+
+        :param stop: optional callable stop(timestamp, voltage, current) called after each pair of readings. The
+                     acquisition ends early once it returns True.
+        """
+        await self.f5790B_async.call(self._start_voltage_triggers, input_terminal)
+        volts, amps, timestamps = np.zeros(samples), np.zeros(samples), np.zeros(samples)
+        count = 0
+        response = ''
+        for idx in range(samples):
+            (tv, response), (ti, amps[idx]) = await asyncio.gather(
+                self.f5790B_async.call(self.trigger_voltage, response),
+                self.f8588A_async.call(self.trigger_f8588A))
+            volts[idx] = VisaClient.parse_float(response.partition(',')[0])
+            timestamps[idx] = (tv + ti) / 2
+            count = idx + 1
+            if stop and stop(timestamps[idx], volts[idx], amps[idx]):
+                break
+        return volts[:count], amps[:count], timestamps[:count]
+
+    def prepare_point(self, source, frequency=None, input_terminal=''):
+        """
+        Programs the source and configures the DMMs for the next breakpoint at the same time: source (a blocking
+        callable that sets up the 5560A output and waits for it) runs on the 5560A's worker while the 8588A function and
+        the 5790B input are set on theirs, so the point waits for the slower of the two rather than for both.
+
+        :param frequency: configures the 8588A for this frequency (see set_f8588A_function). None leaves it unchanged.
+        :param input_terminal: selects the 5790B input (see select_input)
+        """
+        async def prepare():
+            tasks = [self.f5560A_async.call(source)]
+            if frequency is not None:
+                tasks.append(self.f8588A_async.call(self.set_f8588A_function, frequency))
+            if input_terminal:
+                tasks.append(self.f5790B_async.call(self.select_input, input_terminal))
+            await asyncio.gather(*tasks)
+
+        asyncio.run(prepare())
+
+    def wait_settled(self, channels='VA', input_terminal='', timeout=SETTLE_TIMEOUT):
+        """
+        Streams readings from the DMMs measuring the source output until the SettlingDetector declares it settled.
+
+        :param channels: 'V' (5790B), 'A' (8588A) or 'VA' (both, read in parallel)
+        :param input_terminal: 5790B input selected before reading ('V' and 'VA')
+        :param timeout: longest wait (s). The measurement proceeds unsettled after a warning.
+        :return: the settling time (s)
+        """
+        # deadlines and timestamps come from VisaClient.clock, so that a replayed session settles where it did before
+        clock = self.f5790B.clock if channels == 'V' else self.f8588A.clock
+        detector = SettlingDetector(SETTLE_WINDOW, SETTLE_PPM, clock())
+        deadline = detector.start + timeout
+
+        def stop(timestamp, *reading):
+            return detector.add(timestamp, reading) or timestamp > deadline
+
+        if channels == 'VA':
+            while not (detector.settled or clock() > deadline):
+                asyncio.run(self.read_dual_async(input_terminal, 10 * SETTLE_WINDOW, stop))
+                input_terminal = ''
+        elif channels == 'V':
+            self.select_input(input_terminal)
+            response = ''
+            while True:
+                timestamp, response = self.trigger_voltage(response)
+                if stop(timestamp, VisaClient.parse_float(response.partition(',')[0])):
+                    break
+        else:
+            while not stop(*self.trigger_f8588A()):
+                pass
 
-    def connect(self, instruments):
-        try:
-            # ESTABLISH COMMUNICATION TO INSTRUMENTS -------------------------------------------------------------------
-            f5560A_id = {'address': '129.196.136.130', 'port': '3490', 'gpib': '4', 'mode': 'GPIB'}
-            f8588A_id = {'address': '10.205.92.241', 'port': '3490', 'gpib': '24', 'mode': 'GPIB'}
-            f5790B_id = {'address': '', 'port': '', 'gpib': '6', 'mode': 'GPIB'}
-
-            self.connect_to_f5560A(f5560A_id)
-            self.connect_to_f8588A(f8588A_id)
-            self.connect_to_f5790B(f5790B_id)
-
-            if self.f5560A.healthy and self.f8588A.healthy and self.f5790B.healthy:
-                self.connected = True
-                try:
-                    idn_dict = {'DUT': self.f5560A_IDN, 'DMM01': self.f8588A_IDN, 'DMM02': self.f5790B_IDN}
-                    self.analyzer.frame.set_ident(idn_dict)
-                    self.setup_source()
-                except ValueError:
-                    raise
-            else:
-                print('\nUnable to connect to all instruments.\n')
-        except ValueError:
-            raise ValueError('Could not connect. Timeout error occurred.')
+        if detector.settled:
+            print(f'settled in {detector.elapsed:.2f} s ({detector.count} readings)')
+        else:
+            print(f'[WARNING] output not settled after {detector.elapsed:.2f} s '
+                  f'(drift {detector.drift_ppm():.1f} ppm across {SETTLE_WINDOW} readings)')
+        return detector.elapsed
+
+    def _start_voltage_triggers(self, input_terminal=''):
+        # with EXTRIG ON every voltage reading is triggered together with its current reading
+        with self.f5790B.batch(root=False):
+            self.select_input(input_terminal)
+            if self.f5790B_burst:
+                self.f5790B.set_state('EXTRIG', 'ON')
 
     def close_instruments(self):
-        time.sleep(1)
         self.close_f5560A()
         self.close_f8588A()
         self.close_f5790B()
 
 
 class Test:
-    def __init__(self, parent):
+    def __init__(self, parent, instruments=None):
         self.frame = parent
+        self.instruments = instruments or INSTRUMENTS
         self.M = Instruments(self)
+        self.resumed = 0  # dual output points of the last run that were reloaded from an interrupted run
 
     def connect(self, instruments):
-        self.M.close_instruments()
-        time.sleep(2)
+        # sessions opened by a previous run are reused from the VisaClient session pool
         try:
             self.M.connect(instruments)
         except ValueError as e:
@@ -86,159 +268,189 @@ class Test:
     def run(self, params):
         Path('results').mkdir(parents=True, exist_ok=True)
         filename = 'test'
-        path_to_file = f'results\\{filename}_{time.strftime("%Y%m%d_%H%M")}.csv'
+        path_to_file = Path('results') / f'{filename}_{time.strftime("%Y%m%d_%H%M")}.csv'
+        # resume: results file of an interrupted run to continue, or 'latest' for the most recent one
+        resume = params.get('resume')
+        if resume:
+            path_to_file = latest_results() if resume == 'latest' else Path(resume)
+            if path_to_file is None or not path_to_file.exists():
+                raise ValueError(f'no results file to resume ({resume})')
+            print(f'Resuming {path_to_file}')
+        run = path_to_file.stem
+        # only a resumed run reuses its own baselines regardless of age. A new run started within the same minute
+        # has the same name as the previous one, and must not pick up that run's baselines
+        resumed_run = run if resume else ''
+        path_to_breakpoints = path_to_file.with_name(f'{run}_breakpoints.csv')
+        if resume and not path_to_breakpoints.exists():
+            raise ValueError(f'no breakpoint table to resume {path_to_file} ({path_to_breakpoints} is missing)')
+
+        LATENCY.enabled = LATENCY_STATS
+        LATENCY.reset()
 
-        self.setup()  # setup_digitizer instruments
+        headers = ['voltage', 'current', 'frequency', 'phase',
+                   'VREF', 'VMEAS', 'VDelta', 'VOLT_STD', 'VOLT_N',
+                   'IREF', 'IMEAS', 'IDelta', 'CUR_STD', 'CUR_N', 'SETTLE']
 
         # GET BREAKPOINTS ----------------------------------------------------------------------------------------------
-        bkpts = apply_user_limits(create_breakpoints('dualoutput_pts.csv'), params)
+        if resume:
+            # the interrupted run's table, in the order it was measured
+            bkpts = pd.read_csv(path_to_breakpoints)
+        else:
+            bkpts = apply_user_limits(create_breakpoints('dualoutput_pts.csv'), params)
+            # measure exactly the baselines the dual output points reference, and check them before touching an
+            # instrument
+            bkpts, dropped, added = schedule_baselines(bkpts)
+            print(f'Baselines scheduled: {dropped} unreferenced dropped, {added} missing added')
+            if OPTIMIZE_ORDER:
+                bkpts, saved = order_breakpoints(bkpts, COMPENSATION_USED)
+                print(f'Breakpoints reordered. Estimated time saved: {saved:.1f} s')
+            bkpts.to_csv(path_to_breakpoints, sep=',', index=False)
         try:
             bkpts.to_csv('breakpoints.csv', sep=',', index=False)  # write to csv
         except PermissionError:
             print('Breakpoints were not saved!\n'
                   'The file, breakpoints.csv, may currently be open. Close before running.\n')
+        check_baselines(bkpts)
 
-        # BUILD DICTIONARY ---------------------------------------------------------------------------------------------
-        headers = ['voltage', 'current', 'frequency', 'phase',
-                   'VREF', 'VMEAS', 'VDelta', 'VOLT_STD',
-                   'IREF', 'IMEAS', 'IDelta', 'CUR_STD']
+        # every dual output point is appended to the results file as soon as it is measured (see ResultsWriter). The
+        # points are written in table order, so a resumed run continues after the points the file already holds
         self.frame.write_to_log(headers)
+        completed = load_results(path_to_file, headers) if resume else []
+        self.resumed = len(completed)
+        if completed:
+            dual = bkpts['voltage'].ne(0) & bkpts['current'].ne(0)
+            bkpts = schedule_baselines(bkpts[~(dual & (dual.cumsum() <= len(completed)))])[0]
+            print(f'{len(completed)} dual output points already measured. {get_measurement_length(bkpts)} remaining')
+            for row in completed:
+                self.frame.write_to_log(row)
+
+        if not self.M.connected:
+            self.connect(self.instruments)
+        if not self.M.connected:
+            # setup would fail on the instruments that have no session and end the worker thread without a message
+            self.frame.error_dialog('Unable to connect to all instruments. The test was not run.')
+            self.frame.toggle_ctrl()
+            return
+        self.setup()  # setup_digitizer instruments
 
-        # get length of datapoints excluding the baseline measurements to be performed
-        N = get_measurement_length(bkpts)
-        data = {item: np.zeros(N) for item in headers}
+        # PLAN ACQUISITION ---------------------------------------------------------------------------------------------
+        plan = plan_acquisition(bkpts, params['samples'], DIGITIZED_AC)
+        plan.to_csv(path_to_file.with_name(f'{path_to_file.stem}_plan.csv'), sep=',')
+        print(summarize_plan(plan))
 
         current_baseline_measurement = {}
         voltage_baseline_measurement = {}
+        baselines = BaselineCache(BASELINE_CACHE, params.get('baseline_validity', BASELINE_VALIDITY))
+        voltage_idn = f'{self.M.f5560A_IDN},{self.M.f5790B_IDN}'
+        current_idn = f'{self.M.f5560A_IDN},{self.M.f8588A_IDN}'
         state = 0
         old_state = 4
-        spot = 0
 
         # RUN TEST -----------------------------------------------------------------------------------------------------
         samples = params['samples']
-        # https://stackoverflow.com/a/11617194
-        # https://towardsdatascience.com/how-to-make-your-pandas-loop-71-803-times-faster-805030df4f06
-        for idx, row in bkpts.iterrows():
-            voltage = row["voltage"]
-            current = row["current"]
-            frequency = row["frequency"]
-            phase = row["phase"]
-
-            # single output low current
-            if current <= 3.1 and voltage == 0:
-                state = 0
-            # single output high current
-            elif current > 3.1 and voltage == 0:
-                state = 1
-            # dual output low current
-            elif current <= 3.1 and voltage != 0:
-                state = 2
-            # dual output high current
-            elif current > 3.1 and voltage != 0:
-                state = 3
-            else:
-                pass
-
-            if state != old_state:
-                self.prompt = True
-                # https://stackoverflow.com/a/34427083
-                self.frame.show_wiring_dialog(state)
-                old_state = state
-            else:
-                pass
-
-            # single output voltage baseline measurement
-            if current == 0:
-                print(f'single output (V): {voltage}V')
-                self.M.run_source(mode='V', rms=voltage, Ft=frequency)
-
-                # measure voltage
-                voltage_baseline_measurement[(voltage, frequency)] = self.M.read_voltage('INPUT2', samples=samples)[0]
-                time.sleep(0.2)
-
-                self.M.standby_f5560A()
-
-            # single output current baseline measurement
-            elif voltage == 0:
-                print(f'single output (A): {current}A')
-                self.M.run_source(mode='A', rms=current, Ft=frequency)
-                self.M.set_f8588A_function(frequency)
-                time.sleep(1)
-
-                if COMPENSATION_USED:
-                    self.set_compensation(current)
-
-                # measure current
-                current_baseline_measurement[(current, frequency)] = self.M.read_f8588A(samples=samples)[0]
-                time.sleep(0.2)
-
-                self.M.standby_f5560A()
-
-            # dual output measurement
-            else:
-                print(f'dual output: {voltage}V, {current}A, {frequency}Hz, {phase}')
-                # 12mV range not working in dual output.
-                # TODO: Still determining which registers to change. Here'amp_string a manual way...
-                if 0 < voltage <= 12e-3:
-                    self.f5560A.write(f'out {15e-3}V, {current}A,{frequency}Hz; phase {phase}')
-                    time.sleep(1)
-                    self.f5560A.write(f'out {voltage}V, {current}A,{frequency}Hz; phase {phase}')
+        target_ppm = params.get('target_ppm', TARGET_PPM)
+        acq_key = f'samples={samples},target_ppm={target_ppm}'  # part of every baseline cache key
+        with ResultsWriter(path_to_file, headers, resume=bool(resume)) as results:
+            # https://stackoverflow.com/a/11617194
+            # https://towardsdatascience.com/how-to-make-your-pandas-loop-71-803-times-faster-805030df4f06
+            for idx, row in bkpts.iterrows():
+                voltage = row["voltage"]
+                current = row["current"]
+                frequency = row["frequency"]
+                phase = row["phase"]
+
+                # single output low/high current (0/1), dual output low/high current (2/3)
+                state = wiring_state(voltage, current)
+
+                # baselines measured on this bench within the validity window are reused
+                if current == 0:
+                    cached = baselines.get('V', voltage, frequency, voltage_idn, state, acq_key, resumed_run)
+                    if cached is not None:
+                        print(f'single output (V): {voltage}V, {frequency}Hz from the baseline cache')
+                        voltage_baseline_measurement[(voltage, frequency)] = cached
+                        continue
+                elif voltage == 0:
+                    kind = 'A' if get_settings(plan, idx) is None else 'A_DIGITIZED'
+                    cached = baselines.get(kind, current, frequency, current_idn, state, acq_key, resumed_run)
+                    if cached is not None:
+                        print(f'single output (A): {current}A, {frequency}Hz from the baseline cache')
+                        current_baseline_measurement[(current, frequency)] = cached
+                        continue
+
+                if state != old_state:
+                    self.prompt = True
+                    # https://stackoverflow.com/a/34427083
+                    self.frame.show_wiring_dialog(state)
+                    old_state = state
                 else:
-                    self.f5560A.write(f'out {voltage}V, {current}A,{frequency}Hz; phase {phase}')
-
-                self.M.set_f8588A_function(frequency)
-                time.sleep(1)
-
-                self.f5560A.write(f'oper')
-                # LOWS TIED/OPEN ---------------------------------------------------------------------------------------
-                if LOWS_TIED:
-                    self.M.lows('TIED')
+                    pass
+
+                # single output voltage baseline measurement
+                if current == 0:
+                    print(f'single output (V): {voltage}V')
+                    self.M.prepare_point(lambda: self.M.run_source(mode='V', rms=voltage, Ft=frequency),
+                                         input_terminal='INPUT2')
+                    self.M.wait_settled('V', 'INPUT2')
+
+                    # measure voltage
+                    voltage_baseline_measurement[(voltage, frequency)] = self.M.read_voltage(
+                        'INPUT2', samples=samples, target_ppm=target_ppm)[0]
+                    baselines.put('V', voltage, frequency, voltage_idn, state, acq_key,
+                                  voltage_baseline_measurement[(voltage, frequency)], run)
+
+                    self.M.standby_f5560A()
+
+                # single output current baseline measurement
+                elif voltage == 0:
+                    print(f'single output (A): {current}A')
+                    self.M.prepare_point(lambda: self.set_single_output('A', current, frequency), frequency)
+                    self.M.wait_settled('A')
+
+                    # measure current
+                    if get_settings(plan, idx) is not None:
+                        current_baseline_measurement[(current, frequency)] = self.M.read_f8588A_digitized(
+                            frequency, settings=get_settings(plan, idx))[0]
+                    else:
+                        current_baseline_measurement[(current, frequency)] = self.M.read_f8588A(
+                            samples=samples, target_ppm=target_ppm)[0]
+                    baselines.put(kind, current, frequency, current_idn, state, acq_key,
+                                  current_baseline_measurement[(current, frequency)], run)
+
+                    self.M.standby_f5560A()
+
+                # dual output measurement
                 else:
-                    self.M.lows('OPEN')
-
-                if COMPENSATION_USED:
-                    self.set_compensation(current)
-
-                Vmeas, VOLT_STD = self.M.read_voltage('INPUT2', samples=samples)
-                Imeas, CUR_STD = self.M.read_f8588A(samples=samples)[:1]
-                time.sleep(1)
-
-                self.M.standby_f5560A()
-
-                vref = voltage_baseline_measurement[(voltage, frequency)]
-                iref = current_baseline_measurement[(current, frequency)]
-                vdelta = (abs(Vmeas - vref) / vref) * 1e6
-                idelta = (abs(Imeas - iref) / iref) * 1e6
-
-                # save row of data to dictionary
-                data['voltage'][spot] = float(self.f5560A.query('out?').split(',')[0])
-                data['current'][spot] = float(self.f5560A.query('out?').split(',')[2])
-                data['frequency'][spot] = frequency
-                data['phase'][spot] = phase
-
-                data['VREF'][spot] = vref
-                data['VMEAS'][spot] = Vmeas
-                data['VDelta'][spot] = vdelta
-
-                data['IREF'][spot] = iref
-                data['IMEAS'][spot] = Imeas
-                data['IDelta'][spot] = idelta
-
-                data['VOLT_STD'][spot] = VOLT_STD
-                data['CUR_STD'][spot] = CUR_STD
-                spot += 1
-                new_row = [voltage, current, frequency, phase,
-                           vref, Vmeas, vdelta, VOLT_STD,
-                           iref, Imeas, idelta, CUR_STD]
-
-                self.frame.write_to_log(new_row)
-        self.f5560A.write('*RST')
-
-        # convert dictionary to data frame
-        df = pd.DataFrame(data)
-
-        # write to csv
-        df.to_csv(path_to_file, sep=',', index=False)
+                    print(f'dual output: {voltage}V, {current}A, {frequency}Hz, {phase}')
+                    # the 8588A and 5790B are configured while the 5560A output is set up and settles
+                    self.M.prepare_point(lambda: self.set_dual_output(voltage, current, frequency, phase), frequency,
+                                         'INPUT2')
+                    settle_time = self.M.wait_settled('VA', 'INPUT2')
+
+                    Vmeas, VOLT_STD, Imeas, CUR_STD = self.M.measure_dual('INPUT2', samples, target_ppm, frequency,
+                                                                          get_settings(plan, idx))
+
+                    self.M.standby_f5560A()
+
+                    vref = voltage_baseline_measurement[(voltage, frequency)]
+                    iref = current_baseline_measurement[(current, frequency)]
+                    vdelta = (abs(Vmeas - vref) / vref) * 1e6
+                    idelta = (abs(Imeas - iref) / iref) * 1e6
+
+                    # append the row to the results file
+                    out = self.M.f5560A.query_fields('out?')
+                    results.append([VisaClient.parse_float(out[0]), VisaClient.parse_float(out[2]), frequency, phase,
+                                    vref, Vmeas, vdelta, VOLT_STD, self.M.f5790B_samples,
+                                    iref, Imeas, idelta, CUR_STD, self.M.f8588A_samples, settle_time])
+                    new_row = [voltage, current, frequency, phase,
+                               vref, Vmeas, vdelta, VOLT_STD, self.M.f5790B_samples,
+                               iref, Imeas, idelta, CUR_STD, self.M.f8588A_samples, settle_time]
+
+                    self.frame.write_to_log(new_row)
+        self.M.f5560A.write('*RST')
+
+        if LATENCY_STATS:
+            LATENCY.to_json(path_to_file.with_name(f'{path_to_file.stem}_latency.json'))
+            LATENCY.to_csv(path_to_file.with_name(f'{path_to_file.stem}_latency.csv'))
         # close instruments
         self.close_instruments()
 
@@ -246,6 +458,31 @@ class Test:
         print('done')
         self.frame.toggle_ctrl()
     
+    def set_single_output(self, mode, rms, frequency):
+        self.M.run_source(mode=mode, rms=rms, Ft=frequency)
+        if COMPENSATION_USED and mode == 'A':
+            self.set_compensation(rms)
+
+    def set_dual_output(self, voltage, current, frequency, phase):
+        # the 12 mV range cannot be selected directly in dual output, so the output passes through 15 mV first
+        if 0 < voltage <= 12e-3:
+            self.M.f5560A.write(f'out {15e-3}V, {current}A,{frequency}Hz; phase {phase}')
+            if not self.M.f5560A.wait_complete(SETTLE_TIMEOUT):
+                raise ValueError(f'5560A 15 mV output did not settle within {SETTLE_TIMEOUT} s')
+        self.M.f5560A.write(f'out {voltage}V, {current}A,{frequency}Hz; phase {phase}')
+
+        self.M.f5560A.write(f'oper')
+        if not self.M.f5560A.wait_complete(SETTLE_TIMEOUT):
+            raise ValueError(f'5560A dual output did not settle within {SETTLE_TIMEOUT} s')
+        # LOWS TIED/OPEN -----------------------------------------------------------------------------------------------
+        if LOWS_TIED:
+            self.M.set_lows('TIED')
+        else:
+            self.M.set_lows('OPEN')
+
+        if COMPENSATION_USED:
+            self.set_compensation(current)
+
     def set_compensation(self, current):
         if current > 1:
             print('DIST_AMP - 47nF placed in distortion amplifier feedback.')
@@ -259,5 +496,6 @@ class Test:
             time.sleep(2)
 
     def close_instruments(self):
-        if hasattr(self.M, 'DUT') and hasattr(self.M, 'DMM'):
+        if self.M.connected:
             self.M.close_instruments()
+            self.M.connected = False
@@ -170,6 +170,9 @@ class Test:
         filename = 'test'
         path_to_file = f'results\\{filename}_{time.strftime("%Y%m%d_%H%M")}.csv'
 
+        if not all(client.healthy for client in (self.f5560A, self.f8588A, self.f5790A)):
+            self.parent.error_dialog('Unable to connect to all instruments. The test was not run.')
+            return
         self.setup()  # setup_digitizer instruments
 
         # GET BREAKPOINTS ----------------------------------------------------------------------------------------------
@@ -547,6 +550,11 @@ class TestFrame(wx.Frame):
                 'pmin': float(self.text_ctrl_7.GetValue()), 'pmax': float(self.text_ctrl_8.GetValue()),
                 'samples': int(self.text_ctrl_12.GetValue())}
 
+    def error_dialog(self, error_message):
+        print(error_message)
+        dial = wx.MessageDialog(None, str(error_message), 'Error', wx.OK | wx.ICON_ERROR)
+        dial.ShowModal()
+
     def set_ident(self, idn_dict):
         self.text_ctrl_9.SetValue(idn_dict['UUT'])  # UUT
         self.text_ctrl_10.SetValue(idn_dict['DMM01'])  # current DMM
@@ -1,8 +1,11 @@
 import VisaClient
+import AsyncVisaClient
 import time
 
 instruments = {'f5560A': {'address': '129.196.136.130', 'port': '3490', 'gpib': '6', 'mode': 'SOCKET'}}
 
+SETTLE_TIMEOUT = 30  # longest wait (s) for the output to settle
+
 
 ########################################################################################################################
 class f5560A_instrument:
@@ -17,10 +20,11 @@ class f5560A_instrument:
 
     def connect_to_f5560A(self, instr_id):
         # ESTABLISH COMMUNICATION TO INSTRUMENT -----------------------------------------------------------------------
-        self.f5560A = VisaClient.VisaClient(instr_id)  # Fluke 5560A
+        self.f5560A = VisaClient.get_session(instr_id)  # Fluke 5560A
 
         if self.f5560A.healthy:
             self.f5560_connected = True
+            self.f5560A_async = AsyncVisaClient.AsyncVisaClient(self.f5560A)
             self.f5560A_IDN = self.f5560A.query('*IDN?')
         else:
             print('\nUnable to connect to the Fluke 5560A. Check software configuration, ensure instrument are in'
@@ -28,24 +32,29 @@ class f5560A_instrument:
 
     def setup_source(self):
         self.f5560A.write('*RST')
-        time.sleep(1)
-        self.f5560A.write('wizard elbereth; ponwiz on')
-        self.f5560A.write('COMM_MODE SERIAL, COMP')
-        self.f5560A.write('COMM_MODE TELNET, COMP')
+        if not self.f5560A.wait_complete(SETTLE_TIMEOUT):
+            raise ValueError(f'5560A reset did not complete within {SETTLE_TIMEOUT} s')
+        with self.f5560A.batch(root=False):
+            self.f5560A.write('wizard elbereth; ponwiz on')
+            self.f5560A.write('COMM_MODE SERIAL, COMP')
+            self.f5560A.write('COMM_MODE TELNET, COMP')
         self.f5560A.write('^C')
         time.sleep(0.5)
-        self.f5560A.write('MONITOR OFF')
-        self.f5560A.write(f'lows {self.lows}')  # lows open is default state
+        with self.f5560A.batch(root=False):
+            self.f5560A.write('MONITOR OFF')
+            self.f5560A.set_state('LOWS', self.lows.upper())  # lows open is default state
 
     def set_lows(self, lows='open'):
-        read_lows = self.f5560A.query('LOWS?')
-        if lows.capitalize() in ('OPEN', 'TIED'):
-            if self.lows == read_lows:
+        if 'LOWS' not in self.f5560A.shadow:
+            self.f5560A.shadow['LOWS'] = self.f5560A.query('LOWS?').upper()
+        read_lows = self.f5560A.shadow['LOWS']
+        if lows.upper() in ('OPEN', 'TIED'):
+            if lows.upper() == read_lows:
                 print(f'LOWS currently set to {lows}. No action was performed.')
             else:
                 print(f"LOWS {read_lows}, which does not match last known state.\n"
                       f"Proceeding to set LOWS to {lows} and overriding the user's prior selection")
-                self.f5560A.write(f'LOWS {lows}')
+                self.f5560A.set_state('LOWS', lows.upper())
                 self._strobe_f5560A_A7_relays()
                 self.lows = lows
         else:
@@ -62,13 +71,12 @@ class f5560A_instrument:
         try:
             if mode.capitalize() == 'A':
                 self.f5560A.write(f'\nout {rms}A, {Ft}Hz')
-                time.sleep(2)
                 print(f'\nout: {rms}A, {Ft}Hz')
             else:
                 self.f5560A.write(f'\nout {rms}V, {Ft}Hz')
-                time.sleep(2)
                 print(f'\nout: {rms}V, {Ft}Hz')
-            time.sleep(1)
+            if not self.f5560A.wait_complete(SETTLE_TIMEOUT):
+                raise ValueError(f'5560A output did not settle within {SETTLE_TIMEOUT} s')
         except ValueError:
             raise
 
@@ -76,20 +84,23 @@ class f5560A_instrument:
         try:
             self.set_source(mode, rms, Ft)
             self.f5560A.write('oper')
-            time.sleep(5)
+            if not self.f5560A.wait_complete(SETTLE_TIMEOUT):
+                raise ValueError(f'5560A did not enter operate within {SETTLE_TIMEOUT} s')
         except ValueError:
             raise
 
+    async def run_source_async(self, mode, rms, Ft):
+        return await self.f5560A_async.call(self.run_source, mode, rms, Ft)
+
     def standby_f5560A(self):
-        time.sleep(1)
         self.f5560A.write('STBY')
-        self.f5560A.write('*WAI')
-        time.sleep(1)
+        if not self.f5560A.wait_complete(SETTLE_TIMEOUT):
+            raise ValueError(f'5560A did not enter standby within {SETTLE_TIMEOUT} s')
 
     def close_f5560A(self):
+        # the session itself stays open in the VisaClient session pool for the next run
         if self.f5560_connected:
-            time.sleep(1)
-            self.f5560A.close()
+            self.f5560A_async.close()
             self.f5560_connected = False
 
 
@@ -98,7 +109,7 @@ if __name__ == "__main__":
     mode, rms, Ft = 'A', 120e-3, 1000
 
     instr = f5560A_instrument()
-    instr.connect_to_f5560A(instruments)
+    instr.connect_to_f5560A(instruments['f5560A'])
     instr.setup_source()
 
     instr.run_source(mode, rms, Ft)
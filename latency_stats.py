@@ -0,0 +1,85 @@
+import csv
+import json
+import re
+import threading
+from collections import deque
+import numpy as np
+
+# numeric arguments are replaced so that 'out 1.2V, 60Hz' and 'out 10V, 1kHz' are recorded as the same command
+NUMBER = re.compile(r'[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?')
+WHITESPACE = re.compile(r'\s+')
+
+# histogram bin edges (s): 10 us to 100 s, four bins per decade
+BINS = np.logspace(-5, 2, 29)
+
+
+def normalize_command(cmd):
+    return NUMBER.sub('<n>', WHITESPACE.sub(' ', f'{cmd}'.strip())).upper()
+
+
+class LatencyRecorder:
+    """
+    Records the round trip time of every VisaClient write/query/read, keyed by (instrument, operation, command).
+    The most recent 'window' round trips of each key are kept for the percentiles and histograms, along with a running
+    count and total over the whole run.
+    """
+
+    def __init__(self, window=1000):
+        self.enabled = False
+        self.window = window
+        self.lock = threading.Lock()
+        self.samples = {}
+        self.totals = {}
+
+    def reset(self):
+        with self.lock:
+            self.samples = {}
+            self.totals = {}
+
+    def record(self, instrument, op, cmd, elapsed):
+        key = (instrument, op, normalize_command(cmd))
+        with self.lock:
+            if key not in self.samples:
+                self.samples[key] = deque(maxlen=self.window)
+                self.totals[key] = [0, 0.0]
+            self.samples[key].append(elapsed)
+            self.totals[key][0] += 1
+            self.totals[key][1] += elapsed
+
+    def histogram(self, instrument, op, cmd):
+        """:return: (counts, bin edges) of the rolling window of a command"""
+        with self.lock:
+            window = np.array(self.samples.get((instrument, op, normalize_command(cmd)), ()))
+        return np.histogram(window, BINS)
+
+    def stats(self):
+        """:return: list of dicts, one per command, ordered by the total time spent on the command"""
+        with self.lock:
+            items = [(key, np.array(window), *self.totals[key]) for key, window in self.samples.items()]
+
+        rows = []
+        for (instrument, op, cmd), window, count, total in items:
+            p50, p90, p99 = np.percentile(window, [50, 90, 99])
+            rows.append({'instrument': instrument, 'op': op, 'command': cmd, 'count': count, 'total': total,
+                         'mean': window.mean(), 'p50': p50, 'p90': p90, 'p99': p99, 'max': window.max()})
+        return sorted(rows, key=lambda row: row['total'], reverse=True)
+
+    def to_json(self, path):
+        stats = self.stats()
+        for row in stats:
+            counts, _ = self.histogram(row['instrument'], row['op'], row['command'])
+            row['histogram'] = counts.tolist()
+        with open(path, 'w') as f:
+            json.dump({'bins': BINS.tolist(), 'commands': stats}, f, indent=1, default=float)
+
+    def to_csv(self, path):
+        stats = self.stats()
+        header = ['instrument', 'op', 'command', 'count', 'total', 'mean', 'p50', 'p90', 'p99', 'max']
+        with open(path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=header)
+            writer.writeheader()
+            writer.writerows(stats)
+
+
+# process-wide recorder shared by every VisaClient
+LATENCY = LatencyRecorder()
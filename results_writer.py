@@ -0,0 +1,103 @@
+"""
+Crash-safe results file
+
+ResultsWriter appends each completed row to the results CSV as soon as it is measured, instead of keeping the run in
+memory until the last breakpoint. Every row is flushed to the operating system, and the file is fsynced at most every
+FSYNC_INTERVAL seconds and when it is closed, so a crash loses no rows and a power failure at most the last interval:
+
+    with ResultsWriter(path, headers) as writer:
+        writer.append(row)
+
+A run is resumed by opening the same file with resume=True: the rows it already holds are kept (a partial last line
+left by the crash is dropped) and new rows are appended after them.
+"""
+import csv
+import os
+import time
+from pathlib import Path
+
+FSYNC_INTERVAL = 10.0  # longest time (s) between forced writes of the results file to disk
+
+
+def load_results(path, headers):
+    """
+    :param path: results CSV
+    :param headers: expected columns
+    :return: the complete rows of the file, as lists of floats. A row that is cut short or does not parse ends the list.
+    """
+    rows = []
+    with open(path, newline='') as f:
+        reader = csv.reader(f)
+        if next(reader, None) != headers:
+            raise ValueError(f'{path} does not have the columns of a results file')
+        for fields in reader:
+            try:
+                row = [float(field) for field in fields]
+            except ValueError:
+                break
+            if len(row) != len(headers):
+                break
+            rows.append(row)
+    return rows
+
+
+def latest_results(directory='results', pattern='test_*.csv'):
+    """:return: the most recently modified results file in directory, or None"""
+    files = [file for file in Path(directory).glob(pattern) if file.stem.count('_') == 2]
+    return max(files, key=lambda file: file.stat().st_mtime, default=None)
+
+
+class ResultsWriter:
+    def __init__(self, path, headers, resume=False, fsync_interval=FSYNC_INTERVAL):
+        """
+        :param path: results CSV
+        :param headers: column names, written as the first line of a new file
+        :param resume: keep the complete rows already in the file (see load_results) and append after them
+        :param fsync_interval: longest time (s) between fsyncs. 0 fsyncs every row.
+        """
+        self.path = Path(path)
+        self.headers = list(headers)
+        self.fsync_interval = fsync_interval
+        self.rows = load_results(self.path, self.headers) if resume else []
+
+        # the file is rewritten with only its complete rows, so that appending never continues a partial line
+        temporary = self.path.with_name(f'{self.path.name}.tmp')
+        with open(temporary, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(self.headers)
+            writer.writerows(self.rows)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, self.path)
+
+        self.file = open(self.path, 'a', newline='')
+        self.writer = csv.writer(self.file)
+        self.synced = time.monotonic()
+
+    def append(self, row):
+        """Writes one row (values in the order of headers)"""
+        if len(row) != len(self.headers):
+            raise ValueError(f'row has {len(row)} values, expected {len(self.headers)}')
+        self.writer.writerow(row)
+        self.file.flush()
+        self.rows.append(list(row))
+        if time.monotonic() - self.synced >= self.fsync_interval:
+            self.sync()
+
+    def sync(self):
+        os.fsync(self.file.fileno())
+        self.synced = time.monotonic()
+
+    def close(self):
+        if not self.file.closed:
+            self.sync()
+            self.file.close()
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
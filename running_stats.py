@@ -0,0 +1,109 @@
+"""
+Streaming statistics of readings
+
+RunningStats keeps the count, mean, sum of squared deviations (Welford's algorithm), minimum and maximum of a stream of
+readings, so each reading is accumulated in O(1) without keeping the readings themselves. Readings may be single values
+or one value per channel (e.g. the voltage and current of a dual output point), in which case every statistic is an
+array with one entry per channel:
+
+    stats = RunningStats()
+    for reading in readings:
+        stats.add(reading)
+    print(stats.mean, stats.std, stats.sem_ppm)
+
+Accumulators of partial acquisitions combine with merge (Chan et al.), which is also how blocks of readings are added.
+"""
+import numpy as np
+
+
+class RunningStats:
+    __slots__ = ('n', '_mean', '_m2', '_min', '_max')
+
+    def __init__(self, readings=None):
+        self.n = 0
+        self._mean = 0.0
+        self._m2 = 0.0
+        self._min = np.inf
+        self._max = -np.inf
+        if readings is not None:
+            self.extend(readings)
+
+    def add(self, reading):
+        """Accumulates one reading (a value, or one value per channel)"""
+        reading = np.asarray(reading, dtype=float)
+        self.n += 1
+        delta = reading - self._mean
+        self._mean = self._mean + delta / self.n
+        self._m2 = self._m2 + delta * (reading - self._mean)
+        self._min = np.minimum(self._min, reading)
+        self._max = np.maximum(self._max, reading)
+        return self
+
+    def extend(self, readings):
+        """Accumulates a block of readings (readings along the first axis)"""
+        readings = np.asarray(readings, dtype=float)
+        if len(readings):
+            block = RunningStats()
+            block.n = len(readings)
+            block._mean = readings.mean(axis=0)
+            block._m2 = ((readings - block._mean) ** 2).sum(axis=0)
+            block._min = readings.min(axis=0)
+            block._max = readings.max(axis=0)
+            self.merge(block)
+        return self
+
+    def merge(self, other):
+        """Combines the readings accumulated by other into this accumulator"""
+        if other.n == 0:
+            return self
+        n = self.n + other.n
+        delta = other._mean - self._mean
+        self._mean = self._mean + delta * other.n / n
+        self._m2 = self._m2 + other._m2 + delta ** 2 * self.n * other.n / n
+        self._min = np.minimum(self._min, other._min)
+        self._max = np.maximum(self._max, other._max)
+        self.n = n
+        return self
+
+    @property
+    def mean(self):
+        return self._mean if self.n else np.nan
+
+    @property
+    def min(self):
+        return self._min
+
+    @property
+    def max(self):
+        return self._max
+
+    @property
+    def variance(self):
+        """sample variance (n - 1). 0 for fewer than two readings"""
+        return self._m2 / (self.n - 1) if self.n > 1 else self._m2 * 0.0
+
+    @property
+    def std(self):
+        """sample standard deviation"""
+        return np.sqrt(self.variance)
+
+    @property
+    def sem(self):
+        """standard error of the mean"""
+        return self.std / np.sqrt(self.n) if self.n > 1 else self._m2 * 0.0 + np.inf
+
+    @property
+    def sem_ppm(self):
+        """standard error of the mean relative to the mean (ppm)"""
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.nan_to_num(self.sem / abs(self._mean) * 1e6, nan=np.inf)
+
+    def converged(self, target_ppm, min_count=2):
+        """:return: True once at least min_count readings were taken and the sem of every channel is within target"""
+        return self.n >= min_count and bool(np.all(self.sem_ppm <= target_ppm))
+
+    def __len__(self):
+        return self.n
+
+    def __repr__(self):
+        return f'RunningStats(n={self.n}, mean={self.mean}, std={self.std})'
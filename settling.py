@@ -0,0 +1,59 @@
+"""
+Settling detection for the source output
+
+Rather than waiting a fixed time after the output changes, fast readings are streamed from the DMMs into a
+SettlingDetector. The output is declared settled once the drift across the last 'window' readings, taken from a
+straight line fitted to them, stays within 'tolerance_ppm' of their mean:
+
+    detector = SettlingDetector(window=5, tolerance_ppm=10)
+    while not detector.add(*take_reading()):
+        pass
+    print(f'settled in {detector.elapsed:.2f} s')
+
+A reading may be a single value or one value per channel (all channels have to settle).
+"""
+from collections import deque
+import time
+import numpy as np
+
+SETTLE_WINDOW = 5  # readings in the sliding window
+SETTLE_PPM = 10.0  # largest drift across the window (ppm of the mean)
+
+
+class SettlingDetector:
+    def __init__(self, window=SETTLE_WINDOW, tolerance_ppm=SETTLE_PPM, start=None):
+        """:param start: time the output was changed, on the clock of the timestamps (time.perf_counter() if None)"""
+        self.window = max(window, 3)
+        self.tolerance_ppm = tolerance_ppm
+        self.timestamps = deque(maxlen=self.window)
+        self.readings = deque(maxlen=self.window)
+        self.start = time.perf_counter() if start is None else start
+        self.count = 0
+        self.settled = False
+        self.elapsed = 0.0
+
+    def drift_ppm(self):
+        """:return: change across the window of the line fitted to the readings (ppm of the mean, largest channel)"""
+        if len(self.readings) < self.window:
+            return np.inf
+        t = np.array(self.timestamps)
+        t = t - t.mean()
+        readings = np.array(self.readings).reshape(len(t), -1)
+        mean = readings.mean(axis=0)
+        slope = t @ (readings - mean) / (t @ t) if t @ t > 0 else np.zeros_like(mean)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            drift = abs(slope * (t[-1] - t[0]) / mean) * 1e6
+        return np.max(np.nan_to_num(drift, nan=np.inf))
+
+    def add(self, timestamp, reading):
+        """
+        :param timestamp: time (time.perf_counter()) of the reading
+        :param reading: value, or one value per channel
+        :return: True once the output has settled
+        """
+        self.timestamps.append(timestamp)
+        self.readings.append(np.atleast_1d(reading).astype(float))
+        self.count += 1
+        self.elapsed = timestamp - self.start
+        self.settled = self.drift_ppm() <= self.tolerance_ppm
+        return self.settled
@@ -0,0 +1,97 @@
+"""
+Runs dual_output_test.Test headless against the simulated instruments in VisaSimulator.py and reports throughput.
+
+    python simulate_test.py --latency 0.005 --settling 0.5 --samples 5
+
+A run can be recorded to a trace file and replayed later, against the simulator or from a trace of a real bench run
+recorded with visa_trace.record_instruments:
+
+    python simulate_test.py --record results/sim.trace
+    python simulate_test.py --replay results/sim.trace --speed 0.5
+"""
+from dual_output_test import *
+import VisaSimulator
+import visa_trace
+import argparse
+
+
+class HeadlessFrame:
+    """Provides the callbacks Test expects from TestFrame (dual_output_gui.py) without a GUI"""
+
+    def __init__(self):
+        self.flag_complete = False
+        self.prompt = True
+        self.rows = []
+
+    def set_ident(self, idn_dict):
+        for key, idn in idn_dict.items():
+            print(f'{key}: {idn}')
+
+    def set_health(self, report):
+        for role, status in report.items():
+            state = 'OK' if status['healthy'] else f"FAILED ({status['error']})"
+            print(f"{role}: {status['resource']} {state} in {status['elapsed']:.2f} s")
+
+    def show_wiring_dialog(self, state):
+        print(f'Wiring state {state}')
+
+    def write_to_log(self, row_data):
+        self.rows.append(row_data)
+        print(row_data)
+
+    def error_dialog(self, error):
+        print(f'[ERROR] {error}')
+
+    def toggle_ctrl(self):
+        pass
+
+
+def simulated_instruments(latency=0.0, noise=0.0, settling=0.0, reading_time=0.02):
+    options = {'latency': latency, 'noise': noise, 'settling': settling, 'reading_time': reading_time}
+    return {key: {**instr_id, **options} for key, instr_id in VisaSimulator.sim_instruments.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the dual output test against simulated instruments')
+    parser.add_argument('--latency', type=float, default=0.005, help='seconds per bus transfer')
+    parser.add_argument('--noise', type=float, default=2e-6, help='relative noise of each reading')
+    parser.add_argument('--settling', type=float, default=0.5, help='seconds for the source output to settle')
+    parser.add_argument('--reading-time', type=float, default=0.02, help='seconds per 8588A reading')
+    parser.add_argument('--samples', type=int, default=5)
+    parser.add_argument('--baseline-validity', type=float, default=0,
+                        help='reuse cached baselines up to this age (s). 0 measures every baseline')
+    parser.add_argument('--resume', nargs='?', const='latest',
+                        help='continue an interrupted run from its results file (default: the most recent one)')
+    parser.add_argument('--target-ppm', type=float, default=0.0, help='adaptive sample count target (0 for fixed)')
+    parser.add_argument('--vmax', type=float, default=1.2)
+    parser.add_argument('--imax', type=float, default=0.12)
+    parser.add_argument('--fmax', type=float, default=65)
+    parser.add_argument('--pmax', type=float, default=0)
+    parser.add_argument('--record', help='record the session to this trace file')
+    parser.add_argument('--replay', help='replay the session from this trace file instead of simulating')
+    parser.add_argument('--speed', type=float, default=1.0, help='replay timing scale (0 for no delays)')
+    args = parser.parse_args()
+
+    params = {'vmin': 0, 'vmax': args.vmax, 'imin': 0, 'imax': args.imax,
+              'fmin': 0, 'fmax': args.fmax, 'pmin': 0, 'pmax': args.pmax, 'samples': args.samples,
+              'target_ppm': args.target_ppm, 'baseline_validity': args.baseline_validity,
+              'resume': args.resume}
+    instruments = simulated_instruments(args.latency, args.noise, args.settling, args.reading_time)
+    if args.record:
+        instruments = visa_trace.record_instruments(instruments, args.record)
+    elif args.replay:
+        instruments = visa_trace.replay_instruments(instruments, args.replay, args.speed)
+
+    frame = HeadlessFrame()
+    test = Test(frame, instruments)
+
+    start = time.perf_counter()
+    test.run(params)
+    elapsed = time.perf_counter() - start
+
+    points = len(frame.rows) - 1 - test.resumed  # the first row logged is the header, then any reloaded rows
+    print(f'\n{points} dual output points in {elapsed:.1f} s ({points * 3600 / elapsed:.0f} points per hour)')
+
+
+if __name__ == "__main__":
+    main()
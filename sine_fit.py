@@ -0,0 +1,122 @@
+"""
+Sine wave analysis of digitized buffers
+
+Buffers are analyzed many at once: a 2-D array holds one buffer per row (a 1-D array is a single buffer) and every
+result is an array with one entry per buffer. All buffers share N, Fs and the nominal frequency Ft.
+
+    fit3(samples, Fs, Ft)  3 parameter least squares fit at a known frequency (IEEE 1057)
+    fit4(samples, Fs, Ft)  4 parameter fit, iterating on the frequency from the 3 parameter fit (IEEE 1057)
+    fft_analysis(samples, Fs)  windowed FFT estimates of the fundamental and the total harmonic distortion
+
+The fitted model is  samples = amplitude * sin(2 pi frequency t + phase) + offset,  with t = n / Fs and phase in
+radians. The 3 parameter fit is a matrix product with the pseudo-inverse of its design matrix, which is cached by
+(N, Fs, Ft) so that repeated captures of the same configuration do not rebuild it.
+"""
+from functools import lru_cache
+import numpy as np
+
+FIT_ITERATIONS = 4  # Gauss-Newton iterations of the 4 parameter fit
+HARMONICS = 10  # highest harmonic included in the THD
+WINDOW_BINS = 3  # bins either side of a peak summed into its power (Hann main lobe is +/-2 bins)
+
+
+########################################################################################################################
+@lru_cache(maxsize=64)
+def design_matrix(N, Fs, Ft):
+    """:return: design matrix [cos, sin, 1] of the 3 parameter fit and its pseudo-inverse (both read-only)"""
+    w = 2 * np.pi * Ft * np.arange(N) / Fs
+    D = np.column_stack((np.cos(w), np.sin(w), np.ones(N)))
+    pinv = np.linalg.pinv(D)
+    D.flags.writeable = False
+    pinv.flags.writeable = False
+    return D, pinv
+
+
+def _to_polar(a, b):
+    # a cos(wt) + b sin(wt) = amplitude sin(wt + phase)
+    return np.hypot(a, b), np.arctan2(a, b)
+
+
+def fit3(samples, Fs, Ft):
+    """
+    :param samples: buffer (N,) or buffers (M, N)
+    :return: amplitude, phase, offset and rms residual of each buffer
+    """
+    samples = np.asarray(samples, dtype=float)
+    D, pinv = design_matrix(samples.shape[-1], Fs, Ft)
+    a, b, offset = np.moveaxis(samples @ pinv.T, -1, 0)
+    residual = samples - (np.stack((a, b, offset), axis=-1) @ D.T)
+    amplitude, phase = _to_polar(a, b)
+    return amplitude, phase, offset, np.sqrt(np.mean(residual ** 2, axis=-1))
+
+
+def fit4(samples, Fs, Ft, iterations=FIT_ITERATIONS):
+    """
+    Starts from the 3 parameter fit at Ft and refines the frequency of every buffer together with its amplitude, phase
+    and offset. Each iteration solves all buffers' linearized 4 parameter problems as one stacked least squares.
+
+    :param samples: buffer (N,) or buffers (M, N)
+    :return: amplitude, phase, offset, frequency and rms residual of each buffer
+    """
+    samples = np.asarray(samples, dtype=float)
+    x = np.atleast_2d(samples)
+    t = np.arange(x.shape[-1]) / Fs
+
+    D, pinv = design_matrix(x.shape[-1], Fs, Ft)
+    a, b, offset = (x @ pinv.T).T
+    frequency = np.full(len(x), float(Ft))
+    for _ in range(iterations):
+        w = 2 * np.pi * frequency[:, None] * t
+        cos, sin = np.cos(w), np.sin(w)
+        # columns: cos, sin, 1 and the derivative with respect to the angular frequency
+        J = np.stack((cos, sin, np.ones_like(w), t * (b[:, None] * cos - a[:, None] * sin)), axis=-1)
+        a, b, offset, dw = _solve(J, x).T
+        frequency = frequency + dw / (2 * np.pi)
+
+    w = 2 * np.pi * frequency[:, None] * t
+    residual = x - (a[:, None] * np.cos(w) + b[:, None] * np.sin(w) + offset[:, None])
+    amplitude, phase = _to_polar(a, b)
+    results = amplitude, phase, offset, frequency, np.sqrt(np.mean(residual ** 2, axis=-1))
+    return results if samples.ndim > 1 else tuple(value[0] for value in results)
+
+
+def _solve(J, x):
+    # stacked normal equations: (J^T J) p = J^T x for every buffer at once
+    JT = np.swapaxes(J, -1, -2)
+    return np.linalg.solve(JT @ J, (JT @ x[..., None]))[..., 0]
+
+
+########################################################################################################################
+def fft_analysis(samples, Fs, harmonics=HARMONICS):
+    """
+    Hann windowed FFT of each buffer. The fundamental is the largest non-DC peak; its frequency is refined by
+    parabolic interpolation of the log magnitude, and amplitudes come from the power summed over the window's main
+    lobe, which does not depend on where the frequency falls between bins.
+
+    :param samples: buffer (N,) or buffers (M, N)
+    :return: frequency, amplitude and THD (ratio of the rms of harmonics 2..harmonics to the fundamental) of each buffer
+    """
+    samples = np.asarray(samples, dtype=float)
+    N = samples.shape[-1]
+    window = np.hanning(N)
+    power = abs(np.fft.rfft((samples - samples.mean(axis=-1, keepdims=True)) * window, axis=-1)) ** 2
+    scale = 4 / (N * np.sum(window ** 2))
+
+    peak = np.argmax(power[..., 1:], axis=-1) + 1
+    alpha, beta, gamma = (np.log(np.take_along_axis(power, np.clip(peak + k, 0, power.shape[-1] - 1)[..., None],
+                                                    axis=-1)[..., 0] + 1e-300) for k in (-1, 0, 1))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        delta = np.nan_to_num(0.5 * (alpha - gamma) / (alpha - 2 * beta + gamma))
+    frequency = (peak + delta) * Fs / N
+
+    def band_power(center):
+        bins = np.round(center)[..., None].astype(int) + np.arange(-WINDOW_BINS, WINDOW_BINS + 1)
+        inside = (bins > 0) & (bins < power.shape[-1])
+        return np.sum(np.take_along_axis(power, np.clip(bins, 0, power.shape[-1] - 1), axis=-1) * inside, axis=-1)
+
+    fundamental = band_power(peak + delta)
+    harmonic = sum(band_power(h * (peak + delta)) for h in range(2, harmonics + 1)
+                   if np.all(h * (peak + delta) < power.shape[-1] - WINDOW_BINS))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        thd = np.sqrt(harmonic / fundamental)
+    return frequency, np.sqrt(scale * fundamental), thd
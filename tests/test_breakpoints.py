@@ -0,0 +1,54 @@
+import pandas as pd
+import pytest
+
+from breakpoint_order import order_breakpoints, get_features, path_cost
+from dual_output_breakpoints import check_baselines, schedule_baselines
+
+COLUMNS = ['voltage', 'current', 'frequency', 'phase']
+
+
+def table(rows):
+    return pd.DataFrame(rows, columns=COLUMNS, dtype=float)
+
+
+def is_baseline(df):
+    return ((df['voltage'] == 0) | (df['current'] == 0)).to_numpy()
+
+
+BKPTS = table([(0, 0.1, 60, 0), (0, 5.0, 60, 0), (10, 0, 60, 0), (100, 0, 60, 0), (0, 0.1, 400, 0), (10, 0, 400, 0),
+               (10, 0.1, 60, 0), (100, 5.0, 60, 90), (10, 0.1, 400, 0), (100, 0.1, 60, 0), (10, 5.0, 60, 0)])
+
+
+def test_order_breakpoints_reorders_the_same_rows():
+    ordered, saved = order_breakpoints(BKPTS)
+    key = COLUMNS
+    pd.testing.assert_frame_equal(ordered.sort_values(key).reset_index(drop=True),
+                                  BKPTS.sort_values(key).reset_index(drop=True))
+    assert saved >= 0
+    assert path_cost(get_features(ordered)) == pytest.approx(path_cost(get_features(BKPTS)) - saved)
+
+
+def test_order_breakpoints_keeps_baselines_first_and_wires_each_state_once():
+    ordered = order_breakpoints(BKPTS)[0]
+    baseline = is_baseline(ordered)
+    assert baseline[:baseline.sum()].all()
+    for segment in (ordered[baseline], ordered[~baseline]):
+        states = get_features(segment)[:, 0]
+        changes = sum(a != b for a, b in zip(states[:-1], states[1:]))
+        assert changes == len(set(states)) - 1
+
+
+def test_schedule_baselines_drops_unused_and_adds_missing():
+    df = table([(10, 0, 60, 0), (50, 0, 60, 0), (0, 1, 60, 0), (10, 1, 60, 0), (20, 1, 60, 0)])
+    bkpts, dropped, added = schedule_baselines(df)
+    assert (dropped, added) == (1, 1)
+    baselines = bkpts[is_baseline(bkpts)]
+    assert set(zip(baselines['voltage'], baselines['current'])) == {(10, 0), (20, 0), (0, 1)}
+    assert is_baseline(bkpts)[:len(baselines)].all()
+    check_baselines(bkpts)
+
+
+def test_check_baselines_lists_the_missing():
+    df = table([(10, 0, 60, 0), (10, 1, 60, 0), (10, 2, 400, 0)])
+    with pytest.raises(ValueError, match='missing 3 baselines'):
+        check_baselines(df)
@@ -0,0 +1,44 @@
+import pytest
+
+from results_writer import ResultsWriter, load_results
+
+HEADERS = ['idx', 'value']
+
+
+def test_rows_are_written_as_they_are_appended(tmp_path):
+    path = tmp_path / 'test_20260101_0000.csv'
+    with ResultsWriter(path, HEADERS) as writer:
+        writer.append([0, 1.5])
+        assert load_results(path, HEADERS) == [[0.0, 1.5]]
+        writer.append([1, 2.5])
+    assert load_results(path, HEADERS) == [[0.0, 1.5], [1.0, 2.5]]
+
+
+def test_resume_drops_a_partial_row_and_appends(tmp_path):
+    path = tmp_path / 'test_20260101_0000.csv'
+    path.write_text('idx,value\n0,1.5\n1,2.5\n2')
+    with ResultsWriter(path, HEADERS, resume=True) as writer:
+        assert len(writer) == 2
+        writer.append([2, 3.5])
+    assert load_results(path, HEADERS) == [[0.0, 1.5], [1.0, 2.5], [2.0, 3.5]]
+
+
+def test_new_file_replaces_an_old_one(tmp_path):
+    path = tmp_path / 'test_20260101_0000.csv'
+    path.write_text('idx,value\n0,1.5\n')
+    with ResultsWriter(path, HEADERS) as writer:
+        assert len(writer) == 0
+    assert load_results(path, HEADERS) == []
+
+
+def test_resume_checks_the_columns(tmp_path):
+    path = tmp_path / 'test_20260101_0000.csv'
+    path.write_text('a,b,c\n1,2,3\n')
+    with pytest.raises(ValueError):
+        ResultsWriter(path, HEADERS, resume=True)
+
+
+def test_append_checks_the_row_length(tmp_path):
+    with ResultsWriter(tmp_path / 'test_20260101_0000.csv', HEADERS) as writer:
+        with pytest.raises(ValueError):
+            writer.append([1.0])
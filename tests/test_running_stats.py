@@ -0,0 +1,40 @@
+import numpy as np
+
+from running_stats import RunningStats
+
+
+def test_add_matches_numpy():
+    readings = np.random.default_rng(1).normal(10, 0.1, 50)
+    stats = RunningStats()
+    for reading in readings:
+        stats.add(reading)
+    assert stats.n == 50
+    assert np.isclose(stats.mean, readings.mean())
+    assert np.isclose(stats.std, readings.std(ddof=1))
+    assert stats.min == readings.min() and stats.max == readings.max()
+
+
+def test_merge_matches_the_combined_readings():
+    rng = np.random.default_rng(2)
+    a, b = rng.normal(1.0, 1e-3, (30, 2)), rng.normal(1.1, 2e-3, (45, 2))
+    stats = RunningStats(a).merge(RunningStats(b))
+    combined = np.concatenate((a, b))
+    assert stats.n == 75
+    np.testing.assert_allclose(stats.mean, combined.mean(axis=0))
+    np.testing.assert_allclose(stats.std, combined.std(axis=0, ddof=1))
+    np.testing.assert_allclose(stats.sem, combined.std(axis=0, ddof=1) / np.sqrt(75))
+    np.testing.assert_array_equal(stats.min, combined.min(axis=0))
+    np.testing.assert_array_equal(stats.max, combined.max(axis=0))
+
+
+def test_merge_with_empty():
+    readings = [1.0, 2.0, 4.0]
+    stats = RunningStats(readings)
+    assert RunningStats().merge(stats).mean == stats.mean
+    assert stats.merge(RunningStats()).n == 3
+
+
+def test_sem_before_two_readings():
+    assert np.isnan(RunningStats().mean)
+    assert np.isinf(RunningStats([1.0]).sem)
+    assert np.isinf(RunningStats([0.0, 0.0]).sem_ppm)
@@ -0,0 +1,42 @@
+import numpy as np
+
+import sine_fit
+
+Fs, N = 50e3, 5000
+
+
+def sine(amplitude, frequency, phase, offset=0.0):
+    t = np.arange(N) / Fs
+    return amplitude * np.sin(2 * np.pi * frequency * t + phase) + offset
+
+
+def test_fit3_recovers_a_sine_at_a_known_frequency():
+    amplitude, phase, offset, residual = sine_fit.fit3(sine(1.5, 60.0, 0.4, 0.01), Fs, 60.0)
+    assert np.isclose(amplitude, 1.5) and np.isclose(phase, 0.4) and np.isclose(offset, 0.01)
+    assert residual < 1e-12
+
+
+def test_fit3_fits_buffers_together():
+    buffers = np.stack([sine(a, 60.0, 0.1) for a in (0.5, 1.0, 2.0)])
+    np.testing.assert_allclose(sine_fit.fit3(buffers, Fs, 60.0)[0], [0.5, 1.0, 2.0])
+
+
+def test_fit4_finds_an_off_nominal_frequency():
+    amplitude, phase, offset, frequency, residual = sine_fit.fit4(sine(1.0, 60.05, -1.0), Fs, 60.0)
+    assert np.isclose(frequency, 60.05, rtol=1e-9)
+    assert np.isclose(amplitude, 1.0, rtol=1e-9) and np.isclose(phase, -1.0, atol=1e-9)
+    assert residual < 1e-9
+
+
+def test_fit4_residual_of_noise():
+    noise = np.random.default_rng(3).normal(0, 1e-4, N)
+    residual = sine_fit.fit4(sine(1.0, 60.0, 0.0) + noise, Fs, 60.0)[4]
+    assert np.isclose(residual, 1e-4, rtol=0.05)
+
+
+def test_fft_analysis():
+    samples = sine(1.0, 1003.0, 0.2) + sine(0.01, 3009.0, 0.0)
+    frequency, amplitude, thd = sine_fit.fft_analysis(samples, Fs)
+    assert np.isclose(frequency, 1003.0, rtol=1e-3)
+    assert np.isclose(amplitude, 1.0, rtol=1e-3)
+    assert np.isclose(thd, 0.01, rtol=0.02)
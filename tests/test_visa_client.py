@@ -0,0 +1,64 @@
+import io
+import numpy as np
+import pytest
+
+from VisaClient import join_commands, read_ieee_block, parse_float, NO_VALUE
+
+
+class BlockResource:
+    """Serves a byte string through read_bytes, as a pyvisa resource would"""
+
+    def __init__(self, data):
+        self.stream = io.BytesIO(data)
+
+    def read_bytes(self, count):
+        return self.stream.read(count)
+
+
+def block(values, dtype='>f8'):
+    data = np.asarray(values, dtype=dtype).tobytes()
+    return f'#{len(str(len(data)))}{len(data)}'.encode() + data + b'\n'
+
+
+def test_join_commands_returns_to_the_root():
+    assert join_commands(['CONF:VOLT:AC', 'TRIG:COUN 5', '*CLS', ':INIT']) == [':CONF:VOLT:AC;:TRIG:COUN 5;*CLS;:INIT']
+
+
+def test_join_commands_without_root():
+    assert join_commands(['MONITOR OFF', 'LOWS OPEN'], root=False) == ['MONITOR OFF;LOWS OPEN']
+
+
+def test_join_commands_splits_at_max_length():
+    commands = [f'CMD{k}' for k in range(10)]
+    messages = join_commands(commands, max_length=20)
+    assert all(len(message) <= 20 for message in messages)
+    assert ';'.join(messages).split(';') == [f':CMD{k}' for k in range(10)]
+
+
+def test_join_commands_empty():
+    assert join_commands([]) == []
+
+
+def test_read_ieee_block():
+    values = np.linspace(-1, 1, 101)
+    resource = BlockResource(block(values) + b'NEXT')
+    np.testing.assert_array_equal(read_ieee_block(resource), values)
+    # the termination is consumed and the next response is left in place
+    assert resource.read_bytes(4) == b'NEXT'
+
+
+def test_read_ieee_block_little_endian():
+    values = [1.5, -2.25, 1e-9]
+    np.testing.assert_array_equal(read_ieee_block(BlockResource(block(values, '<f8')), dtype='<f8'), values)
+
+
+@pytest.mark.parametrize('data', [b'1.0,2.0\n', b'#0\n'])
+def test_read_ieee_block_rejects_other_responses(data):
+    with pytest.raises(ValueError):
+        read_ieee_block(BlockResource(data))
+
+
+def test_parse_float():
+    assert parse_float('+1.25E-03') == 1.25e-3
+    assert np.isnan(parse_float(f'{NO_VALUE:E}'))
+    assert np.isnan(parse_float('OVLD'))
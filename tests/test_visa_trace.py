@@ -0,0 +1,126 @@
+import shutil
+
+import numpy as np
+import pytest
+import pyvisa as visa
+
+import VisaClient
+import VisaSimulator
+import visa_trace
+from visa_trace import ReplayDivergence, ReplayResourceManager, RecordingResource, TraceRecorder
+
+RESOURCE = 'SIM::8588A'
+CONFIGURATION = ':FORMat:DATA REAL,64;:TRIGger:COUNt 8;:INIT:IMM'
+
+
+class FailingResource:
+    """Fails every read, as an instrument that does not answer"""
+
+    def write(self, message):
+        return len(message)
+
+    def read(self):
+        raise visa.VisaIOError(visa.constants.StatusCode.error_timeout)
+
+    def query(self, message):
+        raise ValueError(f'no response to {message}')
+
+
+def session(instr):
+    """A short session using every kind of transaction. :return: what the instrument returned"""
+    idn = instr.query('*IDN?')
+    instr.write(CONFIGURATION)
+    start = instr.clock()
+    instr.write('FETCH?')
+    block = VisaClient.read_ieee_block(instr)
+    return idn, start, block
+
+
+def record(path, noise=1e-6):
+    recorder = TraceRecorder(path)
+    instrument = VisaSimulator.Simulated8588A(noise=noise, reading_time=0.0)
+    result = session(RecordingResource(instrument, recorder, RESOURCE))
+    recorder.close()
+    return result
+
+
+def test_replay_returns_the_recorded_responses(tmp_path):
+    path = tmp_path / 'session.trace'
+    idn, start, block = record(path)
+    replayed = ReplayResourceManager(path, speed=0).open_resource(RESOURCE)
+    replayed_idn, replayed_start, replayed_block = session(replayed)
+    assert (replayed_idn, replayed_start) == (idn, start)
+    np.testing.assert_array_equal(replayed_block, block)
+
+
+def test_replay_fails_on_a_different_command(tmp_path):
+    path = tmp_path / 'session.trace'
+    record(path)
+    replayed = ReplayResourceManager(path, speed=0).open_resource(RESOURCE)
+    replayed.query('*IDN?')
+    with pytest.raises(ReplayDivergence, match='TRIGger:COUNt 8'):
+        replayed.write(CONFIGURATION.replace('COUNt 8', 'COUNt 9'))
+
+
+def test_replay_fails_on_a_different_operation(tmp_path):
+    path = tmp_path / 'session.trace'
+    record(path)
+    replayed = ReplayResourceManager(path, speed=0).open_resource(RESOURCE)
+    replayed.query('*IDN?')
+    replayed.write(CONFIGURATION)
+    # the recorded run read the clock here
+    with pytest.raises(ReplayDivergence):
+        replayed.write('FETCH?')
+
+
+def test_replay_fails_after_the_last_event(tmp_path):
+    path = tmp_path / 'session.trace'
+    record(path)
+    replayed = ReplayResourceManager(path, speed=0).open_resource(RESOURCE)
+    session(replayed)
+    with pytest.raises(ReplayDivergence, match='after the last'):
+        replayed.query('*IDN?')
+
+
+def test_replay_raises_the_recorded_errors(tmp_path):
+    path = tmp_path / 'errors.trace'
+    recorder = TraceRecorder(path)
+    instr = RecordingResource(FailingResource(), recorder, RESOURCE)
+    instr.write('MEAS?')
+    with pytest.raises(visa.VisaIOError):
+        instr.read()
+    with pytest.raises(ValueError):
+        instr.query('VAL?')
+    recorder.close()
+
+    replayed = ReplayResourceManager(path, speed=0).open_resource(RESOURCE)
+    replayed.write('MEAS?')
+    with pytest.raises(visa.VisaIOError) as error:
+        replayed.read()
+    assert error.value.error_code == visa.constants.StatusCode.error_timeout
+    with pytest.raises(ValueError, match='no response to VAL'):
+        replayed.query('VAL?')
+
+
+def test_client_replays_a_recorded_run(tmp_path):
+    path = str(tmp_path / 'client.trace')
+    instruments = {'f8588A': {**VisaSimulator.sim_instruments['f8588A'], 'noise': 1e-6, 'reading_time': 0.0}}
+
+    def readings(instr_id, count=5):
+        client = VisaClient.VisaClient(instr_id)
+        values = []
+        for _ in range(count):
+            assert client.wait_complete(5, 'INIT:IMM')
+            values.append(client.query_float('FETCH? 1'))
+        client.close()
+        return values
+
+    recorded = readings(visa_trace.record_instruments(instruments, path)['f8588A'])
+    visa_trace.get_recorder(path).close()
+    assert readings(visa_trace.replay_instruments(instruments, path, speed=0)['f8588A']) == recorded
+
+    # a run that asks for more than the recording held has diverged from it
+    diverging = str(tmp_path / 'diverging.trace')
+    shutil.copy(path, diverging)
+    with pytest.raises(ReplayDivergence):
+        readings(visa_trace.replay_instruments(instruments, diverging, speed=0)['f8588A'], count=6)
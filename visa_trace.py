@@ -0,0 +1,216 @@
+"""
+SCPI session recording and deterministic replay for VisaClient
+
+Recording wraps an open pyvisa resource and appends every write, read, query and binary read, with its response (or
+the error it raised) and duration, to a JSON lines trace file:
+
+    instruments = record_instruments(INSTRUMENTS, 'results/bench01.trace')
+
+Replay serves those responses back in place of the instrument (VisaClient mode 'REPLAY'), taking the recorded time
+multiplied by 'speed' (1.0 original timing, 0 as fast as possible):
+
+    instruments = replay_instruments(INSTRUMENTS, 'results/bench01.trace', speed=0.5)
+
+The events of each resource are replayed strictly in order. A transaction that differs from the next recorded one, or
+one beyond the end of the trace, raises ReplayDivergence. Timing decisions (polling deadlines, reading timestamps) read
+VisaClient.clock, which is recorded as an event of its own and replayed like any response, so a replay takes the same
+path through every time dependent loop as the recorded run.
+"""
+import pyvisa as visa
+import base64
+import builtins
+import json
+import threading
+import time
+
+_recorders = {}
+_recorders_lock = threading.Lock()
+
+
+class ReplayDivergence(Exception):
+    """A replayed session asked for a transaction other than the one recorded next"""
+
+
+def record_instruments(instruments, path):
+    """:return: copy of an instruments dict whose sessions are recorded to path"""
+    return {key: {**instr_id, 'record': path} for key, instr_id in instruments.items()}
+
+
+def replay_instruments(instruments, path, speed=1.0):
+    """:return: copy of an instruments dict whose sessions are replayed from the trace at path"""
+    import VisaClient
+    return {key: {**instr_id, 'mode': 'REPLAY', 'resource': VisaClient.resource_name(instr_id), 'trace': path,
+                  'speed': speed} for key, instr_id in instruments.items()}
+
+
+def get_recorder(path):
+    """Returns the recorder writing to path. Sessions recorded to the same path share one trace file."""
+    with _recorders_lock:
+        if path not in _recorders:
+            _recorders[path] = TraceRecorder(path)
+        return _recorders[path]
+
+
+########################################################################################################################
+class TraceRecorder:
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.start = time.perf_counter()
+        self.file = open(path, 'w')
+
+    def record(self, resource, op, cmd='', response=None, duration=0.0, error=None):
+        """:param error: exception raised by the transaction (replayed in place of a response)"""
+        event = {'t': round(time.perf_counter() - self.start, 6), 'dt': round(duration, 6), 'res': resource, 'op': op}
+        if cmd:
+            event['cmd'] = cmd
+        if isinstance(error, visa.VisaIOError):
+            event['error'] = int(error.error_code)
+        elif error is not None:
+            event['exception'] = type(error).__name__
+            event['message'] = f'{error}'
+        elif isinstance(response, bytes):
+            event['raw'] = base64.b64encode(response).decode()
+        elif response is not None:
+            event['resp'] = response
+        with self.lock:
+            self.file.write(json.dumps(event, separators=(',', ':')) + '\n')
+            self.file.flush()
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+class RecordingResource:
+    """Wraps an open pyvisa resource and records every transaction with the instrument"""
+
+    def __init__(self, instr, recorder, resource):
+        self.__dict__.update(instr=instr, recorder=recorder, resource=resource)
+
+    def __getattr__(self, name):
+        return getattr(self.instr, name)
+
+    def __setattr__(self, name, value):
+        # timeout, read_termination, etc. are attributes of the wrapped resource
+        setattr(self.instr, name, value)
+
+    def _timed(self, op, fn, cmd='', *args):
+        start = time.perf_counter()
+        try:
+            response = fn(*args)
+        except Exception as e:
+            # timeouts and other errors are part of the session, and are raised again by the replay
+            self.recorder.record(self.resource, op, cmd, None, time.perf_counter() - start, e)
+            raise
+        self.recorder.record(self.resource, op, cmd, response if op != 'write' else None,
+                             time.perf_counter() - start)
+        return response
+
+    def clock(self):
+        """time.perf_counter(), recorded so that a replay takes the same time dependent decisions"""
+        now = time.perf_counter()
+        self.recorder.record(self.resource, 'clock', response=now)
+        return now
+
+    def write(self, message):
+        return self._timed('write', self.instr.write, message, message)
+
+    def read(self):
+        return self._timed('read', self.instr.read)
+
+    def query(self, message):
+        return self._timed('query', self.instr.query, message, message)
+
+    def read_bytes(self, count):
+        return self._timed('read_bytes', self.instr.read_bytes, f'{count}', count)
+
+    def clear(self):
+        return self._timed('clear', self.instr.clear)
+
+
+########################################################################################################################
+class ReplayResource:
+    """
+    Serves the recorded transactions of one resource strictly in order. Every call has to match the operation and
+    command of the next recorded event, otherwise the replay has diverged from the recording and ReplayDivergence is
+    raised. Recorded errors (e.g. timeouts) are raised again.
+    """
+
+    def __init__(self, resource, events, speed=1.0):
+        self.resource = resource
+        self.events = events
+        self.speed = speed
+        self.position = 0
+        self.timeout = 60000
+        self.read_termination = '\n'
+
+    def _next(self, op, cmd=''):
+        if self.position >= len(self.events):
+            raise ReplayDivergence(f'{self.resource}: {op} {cmd!r} requested after the last of {len(self.events)} '
+                                   f'recorded events')
+        event = self.events[self.position]
+        if event['op'] != op or event.get('cmd', '') != cmd:
+            raise ReplayDivergence(f"{self.resource}: event {self.position} was recorded as {event['op']} "
+                                   f"{event.get('cmd', '')!r}, replay requested {op} {cmd!r}")
+        self.position += 1
+        if self.speed:
+            time.sleep(event['dt'] * self.speed)
+        if 'error' in event:
+            raise visa.VisaIOError(event['error'])
+        if 'exception' in event:
+            exception = getattr(builtins, event['exception'], None)
+            if not (isinstance(exception, type) and issubclass(exception, Exception)):
+                exception = RuntimeError
+            raise exception(event['message'])
+        if 'raw' in event:
+            return base64.b64decode(event['raw'])
+        return event.get('resp')
+
+    def write(self, message):
+        self._next('write', message)
+        return len(message)
+
+    def read(self):
+        return self._next('read')
+
+    def query(self, message):
+        return self._next('query', message)
+
+    def read_bytes(self, count):
+        return self._next('read_bytes', f'{count}')
+
+    def clear(self):
+        self._next('clear')
+
+    def clock(self):
+        return self._next('clock')
+
+    def close(self):
+        pass
+
+
+class ReplayResourceManager:
+    """Stands in for pyvisa.ResourceManager, opening resources from a trace file"""
+
+    def __init__(self, path, speed=1.0):
+        self.speed = speed
+        self.events = {}
+        self.resources = {}
+        with open(path) as f:
+            for line in f:
+                event = json.loads(line)
+                self.events.setdefault(event['res'], []).append(event)
+
+    def list_resources(self):
+        return tuple(self.events)
+
+    def open_resource(self, resource_name, **kwargs):
+        if resource_name not in self.events:
+            raise visa.VisaIOError(visa.constants.StatusCode.error_resource_not_found)
+        # a reopened session continues where the previous one stopped, as the recorded instrument did
+        if resource_name not in self.resources:
+            self.resources[resource_name] = ReplayResource(resource_name, self.events[resource_name], self.speed)
+        return self.resources[resource_name]
+
+    def close(self):
+        pass